@@ -1,12 +1,12 @@
 import math
-import random
-import pandas
 from tqdm import tqdm
 from population import generate
-from util.webapi import cache, init_nhts
+from util.webapi import cache
+from providers import get_provider
 from gis import GastonCountyGIS as gcgis
 import numpy as np
 from scipy.spatial import distance_matrix
+from seeding import RandomStreams, POPULATION, HOUSEHOLDS, LOCATIONS
 
 trip_purposes = {
     1: "Home",
@@ -91,10 +91,6 @@ def income_bracket(income):
     return 11
 
 
-trip_cols = ["HOUSEID", "PERSONID", "HHFAMINC", "WHYTO",
-             "WHYFROM", "STRTTIME", "ENDTIME", "TRPMILES", "R_AGE_IMP", "R_SEX_IMP"]
-
-
 class Trip:
     '''A trip between two unspecified locations for one person.'''
 
@@ -113,10 +109,11 @@ class Trip:
 
     @staticmethod
     def from_dfrow(dfrow):
-        st = dfrow["STRTTIME"]
-        et = dfrow["ENDTIME"]
-        src = dfrow["WHYFROM"]
-        dest = dfrow["WHYTO"]
+        # iterrows hands rows of mixed int and float columns over as floats
+        st = int(dfrow["STRTTIME"])
+        et = int(dfrow["ENDTIME"])
+        src = int(dfrow["WHYFROM"])
+        dest = int(dfrow["WHYTO"])
         trip = Trip(st, et, src, dest)
         trip.household_id = dfrow["HOUSEID"]
         trip.person_id = dfrow["PERSONID"]
@@ -209,8 +206,8 @@ class SyntheticPerson:
         syn_person = SyntheticPerson(pid)
         syn_person.trips = [Trip.from_dfrow(row) for i, row in df.iterrows()]
         syn_person._gen_activities()
-        syn_person.age = df.iloc[0]["R_AGE_IMP"]
-        syn_person.sex = df.iloc[0]["R_SEX_IMP"]
+        syn_person.age = int(df["R_AGE_IMP"].iloc[0])
+        syn_person.sex = int(df["R_SEX_IMP"].iloc[0])
         syn_person.income = 0
         return syn_person
 
@@ -262,8 +259,7 @@ class Location:
 
 def templates():
     print("Reading NHTS trip data.")
-    init_nhts()
-    df = pandas.read_csv("data/nhts/trippub.csv", ",")
+    df = get_provider().trips()
 
     df.sort_values(by=["HOUSEID", "PERSONID", "STRTTIME"], inplace=True)
 
@@ -284,7 +280,7 @@ def templates():
         yield synth_hh
 
 
-def merge_census_data(census_hhs, template_hhs):
+def merge_census_data(census_hhs, template_hhs, rng):
     def match(census_hh, template_hh):
         if len(census_hh.getPeople()) != len(template_hh.people):
             return False
@@ -308,13 +304,13 @@ def merge_census_data(census_hhs, template_hhs):
             # Select matching template_hh
             matching = matching_template_households(census_hh)
             if len(matching) > 0:
-                matches.append(random.choice(matching))
+                matches.append(matching[rng.integers(len(matching))])
             pbar.update(1)
 
     return matches
 
 
-def assign_locations(households, n):
+def assign_locations(households, n, rng):
     print("Loading location data:")
     locations = [loc for loc in gcgis.get_locations()]
 
@@ -340,11 +336,11 @@ def assign_locations(households, n):
     num_workplaces = len(work)
     num_other = len(other)
 
-    random.shuffle(shopping)
-    random.shuffle(schools)
-    random.shuffle(home)
-    random.shuffle(other)
-    random.shuffle(work)
+    rng.shuffle(shopping)
+    rng.shuffle(schools)
+    rng.shuffle(home)
+    rng.shuffle(other)
+    rng.shuffle(work)
 
     # Downscale lists
     scale = n / num_locations
@@ -367,33 +363,33 @@ def assign_locations(households, n):
     print(f"\tOther: {num_other}")
 
     for hh in households:
-        hh_loc = home[random.randint(0, num_homes - 1)]
+        hh_loc = home[rng.integers(num_homes)]
         for person in hh.people:
             for activity in person.activities:
                 act_type = activity.loc_type
                 if act_type == "H":
                     activity.assign_location(hh_loc)
                 elif act_type == "W":
-                    work_loc = work[random.randint(0, num_workplaces - 1)]
+                    work_loc = work[rng.integers(num_workplaces)]
                     activity.assign_location(work_loc)
                 elif act_type == "C":
-                    school_loc = schools[random.randint(0, num_schools - 1)]
+                    school_loc = schools[rng.integers(num_schools)]
                     activity.assign_location(school_loc)
                 elif act_type == "S":
-                    shop_loc = shopping[random.randint(0, num_shops - 1)]
+                    shop_loc = shopping[rng.integers(num_shops)]
                     activity.assign_location(shop_loc)
                 else:
-                    other_loc = other[random.randint(0, num_other - 1)]
+                    other_loc = other[rng.integers(num_other)]
                     activity.assign_location(other_loc)
 
 
-def assign_dummy_locations(households, num_locations):
+def assign_dummy_locations(households, num_locations, rng):
     locations = [Location(i, "?", (0, 0, 0)) for i in range(num_locations)]
 
     for hh in households:
         for person in hh.people:
             for activity in person.activities:
-                activity.assign_location(locations[random.randint(0, num_locations - 1)])
+                activity.assign_location(locations[rng.integers(num_locations)])
 
 
 def generate_locations():
@@ -431,26 +427,40 @@ def generate_locations():
             attractiveness[j, 0] * np.exp(b_w * distance(coords[i], coords[j]))
 
 
-def generate_synthetic(n):
+def generate_synthetic(n, seed=None):
+    '''
+    Synthetic households of n people with their activity locations. The
+    households and their locations are drawn from separate streams under
+    POPULATION (see seeding.py), so the same seed gives the same population
+    whether or not the matched households come from the cache. Only seeded
+    populations are cached, keyed by n and the seed.
+    '''
+    streams = RandomStreams(seed).spawn(POPULATION)
+    rng = streams.generator(HOUSEHOLDS)
     print("Creating template households.")
+    provider = get_provider()
     nhts_hh_templates = cache(
-        'template_households', lambda: [
+        provider.cache_key('template_households'), lambda: [
             hhtmp for hhtmp in templates()],
         folder='nhts_templates')
 
     print("Generating sample population.")
-    census_hhs = generate(n)
+    census_hhs = generate(n, rng)
 
     print("Matching population households to template households.")
-    synthetic_households = cache(
-        str(n) + '_synthetic',
-        lambda: merge_census_data(
-            census_hhs,
-            nhts_hh_templates), folder='synthetic_hh')
+    if seed is None:
+        synthetic_households = merge_census_data(census_hhs, nhts_hh_templates, rng)
+    else:
+        synthetic_households = cache(
+            provider.cache_key(f'{n}_{seed}_synthetic'),
+            lambda: merge_census_data(
+                census_hhs,
+                nhts_hh_templates,
+                rng), folder='synthetic_hh')
 
     print("Assigning activity locations.")
     # 4 people to a location avg (work, home, etc)
-    assign_locations(synthetic_households, int(n / 4))
+    assign_locations(synthetic_households, int(n / 4), streams.generator(LOCATIONS))
     # assign_locations(synthetic_households)
 
     return synthetic_households
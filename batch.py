@@ -0,0 +1,158 @@
+import numpy as np
+from epidemic import ArrayEpidemicSim
+from interaction import activity_probabilities
+from profiling import profiler
+from seeding import RandomStreams, REPLICATE, SETUP
+from state import PersonState, COMPARTMENTS, S, E, I, Q
+
+
+class BatchEpidemicSim(ArrayEpidemicSim):
+    '''
+    Advances several independent replicates of ArrayEpidemicSim at once.
+
+    State is held as a replicates x N matrix, stored replicate-major so that
+    the flat id r * N + i names person i of replicate r. Disease progression
+    therefore reuses ArrayEpidemicSim's vectorized rules unchanged across the
+    whole batch. Each day, the interactions of every replicate are drawn as a
+    replicates x interactions Bernoulli mask over the shared list from
+    generate_interactions, and the transmission kernel runs once over the
+    contacts of all replicates together.
+
+    The batch holds replicates config['replicate'] .. config['replicate'] +
+    replicates - 1, and every replicate draws from its own streams (see
+    seeding.py) in the same order ArrayEpidemicSim would, so each trajectory
+    is bit-identical to running that replicate alone.
+    '''
+
+    engine = 'batch'
+
+    def __init__(self, graph, plot, config={}, replicates=1, population=None):
+        super().__init__(graph, plot, config, population)
+        self.replicates = replicates
+        self.n = len(self.people)
+        self.death_rate = np.tile(self.death_rate, replicates)
+        root = RandomStreams(self.config['seed'])
+        self.streams = [root.spawn(REPLICATE, self.config['replicate'] + r) for r in range(replicates)]
+        self.reset()
+
+    def reset(self):
+        self.state = PersonState(self.replicates * self.n)
+        self.confirmed = np.zeros(self.replicates, dtype=np.int64)
+        self.compartment_counts = np.zeros((self.replicates, len(COMPARTMENTS)), dtype=np.int64)
+        self.compartment_counts[:, S] = self.n
+        self._reset_schedule()
+
+    def counts(self):
+        '''Number of people in each compartment, keyed by letter, as one array per replicate.'''
+        return dict(zip(COMPARTMENTS, self.compartment_counts.T))
+
+    def matrix(self, field='state'):
+        '''A per-person field of PersonState as a replicates x N matrix.'''
+        return getattr(self.state, field).reshape(self.replicates, self.n)
+
+    def _move(self, idx, code):
+        replicate = idx // self.n
+        old = self.state.state[idx]
+        self.compartment_counts -= np.bincount(
+            replicate * len(COMPARTMENTS) + old,
+            minlength=self.replicates * len(COMPARTMENTS)).reshape(self.replicates, len(COMPARTMENTS))
+        self.compartment_counts[:, code] += np.bincount(replicate, minlength=self.replicates)
+        self.state.state[idx] = code
+
+    def _confirm(self, idx):
+        self._move(idx, Q)
+        self.confirmed += np.bincount(idx // self.n, minlength=self.replicates)
+
+    def _use_stream(self, *key):
+        self.rngs = [streams.generator(*key) for streams in self.streams]
+
+    def _current_stream(self):
+        return self.rngs
+
+    def _restore_stream(self, stream):
+        self.rngs = stream
+
+    def _per_replicate(self, idx, draw):
+        '''
+        Concatenate draw(rng, k) over replicates, where k is how many entries of
+        idx belong to each replicate. idx must be grouped by replicate, in
+        replicate order, which flat ids from np.flatnonzero always are.
+        '''
+        sizes = np.bincount(idx // self.n, minlength=self.replicates)
+        return np.concatenate([draw(rng, k) for rng, k in zip(self.rngs, sizes)])
+
+    def _uniform(self, idx):
+        return self._per_replicate(idx, lambda rng, k: rng.random(k))
+
+    def _choice(self, idx, table):
+        return self._per_replicate(idx, lambda rng, k: table.draw(rng, k))
+
+    def _integers(self, idx, low, high):
+        return self._per_replicate(idx, lambda rng, k: rng.integers(low, high, size=k))
+
+    def start(self):
+        '''Make everyone susceptible, then infect one random person in every replicate.'''
+        self.reset()
+        self.day = 0
+        self._use_stream(SETUP)
+        patient_zero = np.array([rng.integers(self.n) for rng in self.rngs]) + np.arange(self.replicates) * self.n
+        self._expose(patient_zero)
+        self._infect(patient_zero)
+
+    def _distanced(self):
+        if not self.config['distancing']['enable_after_confirmed']:
+            return np.ones(self.replicates, dtype=bool)
+        return self.confirmed > 0
+
+    def _sample(self, codes, distanced):
+        '''
+        Replicates x interactions mask of the interactions that happen today,
+        with the same probabilities as ArrayEpidemicSim._sample. distanced
+        holds _distanced for every replicate as of the start of the day.
+        '''
+        percent = self.config['percent_interaction']
+        act_p = activity_probabilities(self.config['distancing'])[codes]
+        p = np.where(distanced[:, np.newaxis], percent * act_p[np.newaxis, :], percent)
+        return np.stack([rng.random(len(codes)) for rng in self.rngs]) < p
+
+    def _contacts(self, u, v, sampled):
+        replicate, k = np.nonzero(sampled)
+        offset = replicate * self.n
+        return offset + u[k], offset + v[k]
+
+    def simulate(self, potential_interactions, days, verbose=False):
+        '''
+        Advance every replicate for up to days days. Returns one history per
+        replicate (see EpidemicSim.simulate) and, for each, whether the disease
+        died out in time. As with ArrayEpidemicSim.simulate, the potential
+        interactions may be sharded, or None for the 'location' transmission.
+        '''
+        return super().simulate(potential_interactions, days, verbose)
+
+    def simulate_arrays(self, u, v, codes, days, verbose=False):
+        return super().simulate_arrays(u, v, codes, days, verbose)
+
+    def simulate_chunks(self, chunks, days, verbose=False):
+        self._prepare(chunks)
+        history = []
+        for day in range(days):
+            profiler.day = self.day
+            history.append(self.compartment_counts.copy())
+            if verbose:
+                print(f"Day {day + 1}\t" + "\t".join(
+                    f"{c}: {self.compartment_counts[:, i].mean():.1f}" for i, c in enumerate(COMPARTMENTS)))
+            infected = self.compartment_counts[:, E] + self.compartment_counts[:, I] + self.compartment_counts[:, Q]
+            if not infected.any():
+                break
+            self._step(chunks)
+            self.day += 1
+
+        history = np.stack(history, axis=1)
+        histories = []
+        finished = []
+        for r in range(self.replicates):
+            infected = history[r, :, E] + history[r, :, I] + history[r, :, Q]
+            end = np.flatnonzero(infected == 0)
+            finished.append(len(end) > 0)
+            histories.append(history[r, :end[0] + 1] if len(end) else history[r])
+        return histories, np.array(finished)
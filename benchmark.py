@@ -0,0 +1,231 @@
+import argparse
+import json
+import os
+import resource
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import numpy as np
+from interaction import generate_interactions, sample_interactions, people_ids, InteractionChunks
+from seeding import DAY
+from synthetic import synthetic_graph
+from graph_io import read_binary, write_binary, read_graph, write_graph
+import epidemic
+
+'''
+    Benchmarks of the pipeline on synthetic graphs (see synthetic.py), so
+    they run without the Census API, the NHTS files or the parcel data.
+
+    For every size on the ladder a fresh process builds a graph of that
+    many people and times, in order, each step listed in steps. The peak
+    resident memory of that process is reported alongside, and with
+    --trace-memory the peak of the memory allocated within each step too
+    (tracemalloc slows the steps down, so timings taken with it are not
+    comparable with timings taken without).
+
+    run_one_iter is one day of the engine: for the graph engine, progress
+    and transmission over the sampled interactions; for the array engine,
+    the day simulate runs (its own sampling included), whichever the
+    transmission.
+
+    Scaling is summarized per step as the slope of log(time) against
+    log(people): 1 means linear, 2 quadratic.
+'''
+
+steps = ('synthetic_graph', 'write_gml', 'read_gml', 'write_binary', 'read_binary', 'generate_interactions',
+         'sample_interactions', 'run_one_iter', 'full_run')
+
+default_sizes = (1000, 10000, 100000, 1000000)
+
+
+class Timer:
+    def __init__(self, trace_memory):
+        self.trace_memory = trace_memory
+        self.times = {}
+        self.memory = {}
+
+    def time(self, name, f, *args, repeat=1):
+        '''Run f(*args) repeat times, keep the mean time, and return its last result.'''
+        if self.trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        for _ in range(repeat):
+            result = f(*args)
+        self.times[name] = (time.perf_counter() - start) / repeat
+        if self.trace_memory:
+            self.memory[name] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        return result
+
+
+def _sample(sim, potential_interactions):
+    sim._use_stream(DAY, sim.day)
+    return sample_interactions(
+        sim, potential_interactions, sim.config['percent_interaction'], sim.config['distancing'])
+
+
+def _full_run(sim, potential_interactions, days):
+    sim.start()
+    return sim.simulate(potential_interactions, days, verbose=False)
+
+
+def run_size(n, engine, config, seed=None, days=100, repeat=3, trace_memory=False):
+    '''
+    Time every step for a synthetic graph of n people, simulated by the
+    engine of that name with config (see epidemic.default_config). Returns the timings
+    (seconds), the traced peaks (bytes, empty without trace_memory) and a
+    few facts about the graph.
+    '''
+    timer = Timer(trace_memory)
+    G = timer.time('synthetic_graph', synthetic_graph, n, np.random.default_rng(seed))
+    # before any simulation adds its state to the nodes
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'graph.txt')
+        timer.time('write_gml', write_graph, G, path)
+        gml_bytes = os.path.getsize(path)
+        timer.time('read_gml', read_graph, path)
+        path = os.path.join(tmp, 'graph.graph')
+        timer.time('write_binary', write_binary, G, path)
+        binary_bytes = sum(f.stat().st_size for f in os.scandir(path))
+        timer.time('read_binary', read_binary, path)
+    potential_interactions = timer.time('generate_interactions', generate_interactions, G)
+
+    sim = epidemic.engines[engine](G, False, config)
+    sim.start()
+    interactions = timer.time('sample_interactions', _sample, sim, potential_interactions, repeat=repeat)
+    if isinstance(sim, epidemic.ArrayEpidemicSim):
+        chunks = InteractionChunks(potential_interactions, people_ids(potential_interactions.people, sim.index))
+        sim._prepare(chunks)
+        timer.time('run_one_iter', sim._step, chunks, repeat=repeat)
+    else:
+        timer.time('run_one_iter', sim._run_one_iter, interactions, repeat=repeat)
+
+    sim = epidemic.engines[engine](G, False, config)
+    history, finished = timer.time('full_run', _full_run, sim, potential_interactions, days)
+    return {
+        'people': n,
+        'locations': len(G.locations),
+        'visits': len(G),
+        'potential_interactions': len(potential_interactions),
+        'gml_bytes': gml_bytes,
+        'binary_bytes': binary_bytes,
+        'days_run': len(history),
+        'times': timer.times,
+        'traced_peak': timer.memory,
+        # kilobytes on Linux
+        'peak_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    }
+
+
+def run_ladder(sizes, engine, config, seed=None, days=100, repeat=3, trace_memory=False):
+    '''
+    run_size for every size, each in a process of its own so that its peak
+    memory is its own. A size that fails, e.g. by running out of memory,
+    is reported with its error and the ladder moves on.
+    '''
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for n in sizes:
+        print(f'Benchmarking {n} people...')
+        try:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                result = pool.submit(run_size, n, engine, config, seed, days, repeat, trace_memory).result()
+        # BrokenProcessPool when the worker is killed, e.g. for running out of memory
+        except Exception as e:
+            result = {'people': n, 'error': repr(e)}
+        results.append(result)
+        print(format_row(result))
+    return results
+
+
+def scaling(results):
+    '''Slope of log(time) against log(people) for every step, over the sizes that finished.'''
+    done = [r for r in results if 'error' not in r]
+    if len(done) < 2:
+        return {}
+    people = np.log([r['people'] for r in done])
+    slopes = {}
+    for step in steps:
+        t = np.array([r['times'][step] for r in done])
+        if (t > 0).all():
+            slopes[step] = float(np.polyfit(people, np.log(t), 1)[0])
+    return slopes
+
+
+def format_row(result):
+    if 'error' in result:
+        return f"{result['people']:>10}  failed: {result['error']}"
+    times = ''.join(f"{result['times'][step]:>14.4f}" for step in steps)
+    return f"{result['people']:>10}{result['potential_interactions']:>14}{times}{result['peak_rss'] / 2**20:>12.1f}"
+
+
+def summary(results):
+    '''A table of the timings (seconds) and peak memory per size, and the scaling of every step.'''
+    lines = [f"{'People':>10}{'Interactions':>14}" + ''.join(f'{step[:13]:>14}' for step in steps) + f"{'Peak MB':>12}"]
+    lines += [format_row(r) for r in results]
+    traced = [r for r in results if r.get('traced_peak')]
+    if traced:
+        lines.append('\nTraced peak per step (MB):')
+        for r in traced:
+            lines.append(f"{r['people']:>10}{'':>14}" +
+                         ''.join(f"{r['traced_peak'][step] / 2**20:>14.1f}" for step in steps))
+    slopes = scaling(results)
+    if slopes:
+        lines.append('\nScaling exponent (time ~ people^k):')
+        lines += [f'\t{step:<24}{k:.2f}' for step, k in slopes.items()]
+    return '\n'.join(lines)
+
+
+def plot(results):
+    import matplotlib.pyplot as plt
+    done = [r for r in results if 'error' not in r]
+    people = [r['people'] for r in done]
+    fig, (left, right) = plt.subplots(1, 2, figsize=(12, 5))
+    for step in steps:
+        left.loglog(people, [r['times'][step] for r in done], marker='o', label=step)
+    left.set_xlabel('People')
+    left.set_ylabel('Seconds')
+    left.legend()
+    right.loglog(people, [r['peak_rss'] / 2**20 for r in done], marker='o')
+    right.set_xlabel('People')
+    right.set_ylabel('Peak memory (MB)')
+    plt.show()
+
+
+def parse_args(argv=None):
+    argparser = argparse.ArgumentParser(description='Time the pipeline on synthetic graphs of growing size.')
+    argparser.add_argument('--sizes', dest='sizes', type=lambda s: [int(n) for n in s.split(',')],
+        default=list(default_sizes), help='comma-separated population sizes (default: 1000,10000,100000,1000000)')
+    argparser.add_argument('--engine', dest='engine', choices=epidemic.engines.keys(), default='graph',
+        help='simulation engine to time')
+    argparser.add_argument('--transmission', dest='transmission',
+        choices=epidemic.ArrayEpidemicSim.transmissions, default='sequential',
+        help='transmission kernel to time')
+    argparser.add_argument('--days', dest='days', type=int, default=100,
+        help='the max number of days of the full run')
+    argparser.add_argument('--repeat', dest='repeat', type=int, default=3,
+        help='times to repeat the per-day steps (sampling and one iteration) to average them')
+    argparser.add_argument('--seed', dest='seed', type=int, default=None,
+        help='seed for the synthetic graphs and the simulations')
+    argparser.add_argument('--trace-memory', dest='trace_memory', action='store_true', default=False,
+        help='also measure the peak memory allocated by each step (slows the steps down)')
+    argparser.add_argument('--report', dest='report',
+        help='write the results and the scaling exponents to this JSON file')
+    argparser.add_argument('--plot', '-p', dest='p', action='store_true', default=False,
+        help='use matplotlib to plot the scaling curves')
+    return argparser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    config = {'transmission': args.transmission, 'seed': args.seed, 'days': args.days}
+    results = run_ladder(args.sizes, args.engine, config, args.seed, args.days, args.repeat, args.trace_memory)
+    print()
+    print(summary(results))
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump({'results': results, 'scaling': scaling(results)}, f, indent=2)
+    if args.p:
+        plot(results)
@@ -0,0 +1,116 @@
+import json
+import os
+import numpy as np
+from interaction import load_interactions
+from state import PersonState
+import epidemic
+
+'''
+    Checkpoint and resume of a running simulation.
+
+    A checkpoint is one compressed .npz file holding everything needed to
+    carry on from the start of a day: the per-person disease state (see
+    state.PersonState), confirmed, the history of compartment counts so
+    far, the day, and the config. Random draws are keyed by
+    (seed, replicate, day, phase) (see seeding.py), so the seed and the day
+    pin down the random state, and a resumed run draws exactly the numbers
+    the interrupted one would have.
+
+    The potential interactions from generate_interactions do not change
+    during a run, so they are written once, next to the checkpoint, as an
+    interaction.Interactions table that a resumed run maps back from disk.
+'''
+
+
+def interactions_path(path):
+    return path + '.interactions'
+
+
+def _write_npz(path, **arrays):
+    # write to a temporary file first so a crash never leaves a torn checkpoint
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez_compressed(f, **arrays)
+    os.replace(tmp, path)
+
+
+def save_checkpoint(sim, path):
+    '''Write the state of sim at the start of day sim.day to path.'''
+    if sim.engine not in epidemic.engines:
+        raise ValueError(f'cannot checkpoint a {type(sim).__name__}')
+    meta = {
+        'engine': sim.engine,
+        # a run without a seed still has one, drawn from fresh entropy
+        'config': {**sim.config, 'seed': sim.streams.seed},
+        'day': sim.day,
+        'confirmed': int(sim.confirmed),
+        'last_confirmed': int(sim.last_confirmed),
+    }
+    state = sim.export_state()
+    arrays = {name: getattr(state, name) for name in PersonState.fields}
+    if sim.engine == 'array':
+        people, ages, sexes = sim.population
+        arrays.update(people=np.array([str(p) for p in people]), ages=ages, sexes=sexes)
+    history = np.array(sim.history, dtype=np.int64).reshape(-1, len(sim.compartment_counts))
+    _write_npz(path, meta=np.array(json.dumps(meta)), history=history, **arrays)
+
+
+class Checkpointer:
+    '''
+    Saves a checkpoint of the simulation at the end of every every-th day.
+    Set an instance as EpidemicSim.checkpointer to use it. When given, the
+    potential interactions are written alongside the checkpoint right away.
+    '''
+
+    def __init__(self, path, every, potential_interactions=None):
+        self.path = path
+        self.every = every
+        if potential_interactions is not None:
+            potential_interactions.save(interactions_path(path))
+
+    def __call__(self, sim):
+        if sim.day % self.every == 0:
+            # so that the output written so far covers the checkpoint
+            for sink in sim.sinks:
+                sink.flush()
+            save_checkpoint(sim, self.path)
+
+
+def resume(path, graph=None, plot=False):
+    '''
+    Rebuild the simulation saved at path. Returns it along with the potential
+    interactions saved next to it, ready to continue with
+    sim.simulate(potential_interactions, sim.days - sim.day).
+
+    A checkpoint of the array engine carries its own population, so graph
+    can be left out. The graph engine keeps state on the graph and needs it.
+    '''
+    with np.load(path) as data:
+        meta = json.loads(str(data['meta']))
+        history = data['history']
+        state = PersonState(len(data['state']))
+        for name in PersonState.fields:
+            setattr(state, name, data[name])
+        population = (data['people'].tolist(), data['ages'], data['sexes']) if 'people' in data else None
+
+    config = meta['config']
+    # JSON turned the age brackets into strings
+    config['deaths_by_age'] = {int(age): p for age, p in config['deaths_by_age'].items()}
+    engine = epidemic.engines[meta['engine']]
+    if population is not None:
+        sim = engine(graph, plot, config, population=population)
+    elif graph is None:
+        raise ValueError(f"resuming the {meta['engine']} engine needs the graph it was run on")
+    else:
+        sim = engine(graph, plot, config)
+    if len(sim.people) != len(state.state):
+        raise ValueError(f'checkpoint has {len(state.state)} people but the graph has {len(sim.people)}')
+
+    sim.day = meta['day']
+    sim.import_state(state)
+    sim.confirmed = meta['confirmed']
+    sim.last_confirmed = meta['last_confirmed']
+    sim.history = list(history)
+    # none were saved for a simulation that does without them
+    interactions = interactions_path(path)
+    return sim, load_interactions(interactions) if os.path.isdir(interactions) else None
@@ -0,0 +1,151 @@
+import time
+import numpy as np
+from tqdm import tqdm
+from interaction import generate_interactions
+from profiling import profiler
+from seeding import RandomStreams
+from visit_graph import VisitGraph
+from util.processes import fork_pool
+from state import COMPARTMENTS, E, I, Q, R, D
+import epidemic
+
+'''
+    Monte Carlo ensembles of EpidemicSim runs.
+
+    The graph is loaded and generate_interactions is run once. Each worker
+    process receives both once (through the pool initializer, inherited
+    copy-on-write where processes fork, see util/processes.py) and then
+    runs whole replicates, or batches of them (see batch.BatchEpidemicSim),
+    returning their per-day S/E/I/Q/R/D curves. Replicate r always draws from
+    the same streams (see seeding.py), so results do not depend on the
+    number of workers or the batch size. The curves are then reduced to a mean and percentile
+    bands per day.
+'''
+
+_worker = {}
+
+
+def _init_worker(graph, potential_interactions, engine, config):
+    _worker['graph'] = graph
+    _worker['potential_interactions'] = potential_interactions
+    _worker['engine'] = engine
+    _worker['config'] = config
+
+
+def _run_replicate(replicate):
+    config = {**_worker['config'], 'replicate': replicate}
+    sim = epidemic.engines[_worker['engine']](_worker['graph'], False, config)
+    sim.start()
+    history, finished = sim.simulate(_worker['potential_interactions'], sim.days, verbose=False)
+    return [history]
+
+
+def _run_batch(replicates):
+    from batch import BatchEpidemicSim
+    config = {**_worker['config'], 'replicate': replicates.start}
+    sim = BatchEpidemicSim(_worker['graph'], False, config, replicates=len(replicates))
+    sim.start()
+    histories, finished = sim.simulate(_worker['potential_interactions'], sim.days)
+    return histories
+
+
+def pad_histories(histories):
+    '''
+    Stack per-replicate histories of different lengths into one
+    (replicates x days x compartments) array. A replicate that ended early
+    keeps its last day's counts, since nothing changes once nobody is infected.
+    '''
+    days = max(len(h) for h in histories)
+    padded = np.empty((len(histories), days, len(COMPARTMENTS)), dtype=np.int64)
+    for r, h in enumerate(histories):
+        padded[r, :len(h)] = h
+        padded[r, len(h):] = h[-1]
+    return padded
+
+
+def summarize(histories, percentiles=(5, 50, 95)):
+    '''
+    Per-day mean and percentile bands across replicates. Each entry is a
+    (days x 7) array: one column per compartment, then the total infected
+    (E + I + Q).
+    '''
+    padded = pad_histories(histories)
+    infected = padded[:, :, E] + padded[:, :, I] + padded[:, :, Q]
+    padded = np.concatenate([padded, infected[:, :, np.newaxis]], axis=2)
+    summary = {'mean': padded.mean(axis=0)}
+    for p in percentiles:
+        summary[f'p{p}'] = np.percentile(padded, p, axis=0)
+    return summary
+
+
+def run_ensemble(graph, engine, config, replicates, workers=1, seed=None, batch_size=1, potential_interactions=None):
+    '''
+    Run replicates independent simulations of graph and return their
+    histories (see EpidemicSim.simulate) along with the wall time taken.
+
+    With batch_size > 1, each task advances batch_size replicates together in
+    a BatchEpidemicSim instead of running them one after another, which
+    needs the array engine. The
+    potential interactions of graph are generated unless given or not
+    needed (see epidemic.needs_interactions).
+    '''
+    if potential_interactions is None and epidemic.needs_interactions(config):
+        with profiler.phase('generate_interactions'):
+            potential_interactions = generate_interactions(graph, workers)
+    if engine == 'graph' and isinstance(graph, VisitGraph):
+        # the graph engine keeps its state on a NetworkX graph, built here once
+        # rather than by every replicate (see EpidemicSim._graph)
+        graph = graph.to_networkx()
+    # every replicate hangs off the same root, even when no seed is given
+    config = {**config, 'seed': RandomStreams(seed).seed}
+    if batch_size > 1 and engine != 'array':
+        raise ValueError(f'batches of replicates run on the array engine, not the {engine} engine')
+    if batch_size > 1:
+        run = _run_batch
+        tasks = [range(i, min(i + batch_size, replicates)) for i in range(0, replicates, batch_size)]
+    else:
+        run = _run_replicate
+        tasks = range(replicates)
+
+    start_time = time.time()
+    if workers > 1:
+        chunksize = max(1, len(tasks) // (workers * 4))
+        with fork_pool(workers, _init_worker, (graph, potential_interactions, engine, config)) as pool:
+            results = list(tqdm(pool.map(run, tasks, chunksize=chunksize), total=len(tasks)))
+    else:
+        _init_worker(graph, potential_interactions, engine, config)
+        results = [run(task) for task in tqdm(tasks)]
+    elapsed = time.time() - start_time
+    histories = [history for result in results for history in result]
+    return histories, elapsed
+
+
+def report(histories, elapsed, workers, plot=False):
+    summary = summarize(histories)
+    infected = len(COMPARTMENTS)
+
+    print('\nDay\t' + '\t'.join(COMPARTMENTS) + '\tInfected (p5 - p95)')
+    for day in range(len(summary['mean'])):
+        means = '\t'.join(f'{x:.1f}' for x in summary['mean'][day, :infected])
+        print(f"{day + 1}\t{means}\t" +
+              f"{summary['p5'][day, infected]:.0f} - {summary['p95'][day, infected]:.0f}")
+
+    ends = np.array([len(h) - 1 for h in histories])
+    peaks = np.array([(h[:, E] + h[:, I] + h[:, Q]).max() for h in histories])
+    print('\nEnsemble Summary:')
+    print(f'\tReplicates: \t\t{len(histories)}')
+    print(f'\tDays to End: \t\t{ends.mean():.1f} (p5 {np.percentile(ends, 5):.0f}, p95 {np.percentile(ends, 95):.0f})')
+    print(f'\tPeak Infections: \t{peaks.mean():.1f} (p5 {np.percentile(peaks, 5):.0f}, p95 {np.percentile(peaks, 95):.0f})')
+    print(f'\tWall Time: \t\t{elapsed:.2f}s on {workers} worker(s)')
+    print(f'\tThroughput: \t\t{len(histories) / elapsed:.2f} replicates/s')
+
+    if plot:
+        import matplotlib.pyplot as plt
+        days = list(range(len(summary['mean'])))
+        for col, label in [(infected, 'Infected'), (R, 'Recovered'), (D, 'Dead')]:
+            plt.plot(days, summary['mean'][:, col], label=label)
+            plt.fill_between(days, summary['p5'][:, col], summary['p95'][:, col], alpha=0.3)
+        plt.legend()
+        plt.ylabel('Number of People')
+        plt.xlabel('Days')
+        plt.show()
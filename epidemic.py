@@ -1,9 +1,22 @@
 import argparse
+import copy
+from array import array
 import networkx as nx
 from actors import SyntheticHousehold, SyntheticPerson, generate_synthetic
 from util.webapi import cache
-from interaction import generate_interactions, sample_interactions
-import random
+from interaction import generate_interactions, sample_interactions, index_interactions, activity_probabilities, \
+    graph_visits, Interactions, ShardedInteractions, InteractionChunks, people_ids
+from transmission import kernels, chunked, Incidence, LocationSlots
+from state import PersonState, COMPARTMENTS, S, E, I, Q, R, D
+from output import ConsoleSink, open_sink, formats
+from profiling import profiler
+from sampling import AliasTable
+from schedule import Scheduler
+from providers import OfflineProvider, set_provider
+import interaction_cache
+from graph_io import read_graph, write_graph
+from visit_graph import VisitGraph, as_visit_graph, activity_types
+from seeding import RandomStreams, REPLICATE, SETUP, DAY, PROGRESS, SAMPLE, TRANSMIT
 from tqdm import tqdm
 import numpy as np
 from scipy.stats import norm
@@ -43,6 +56,11 @@ default_config = {
         'O': 0.02, # percent of other activities
         'enable_after_confirmed': True  # enables only after first detected "quarantined" case
     },
+    'transmission': 'sequential',  # 'sequential' (exact per-interaction draws), 'sparse', 'infectious' or 'location' (see transmission.py)
+    'slot_minutes': 15,  # with 'location' transmission, the length of the time slots visits are binned into
+    'contact_minutes': 60,  # with 'location' transmission, infectious person-minutes worth one potential interaction
+    'seed': None,  # root of every random stream (see seeding.py); None for fresh entropy
+    'replicate': 0,  # which replicate's streams this simulation draws from
     'days': 1000
 }
 
@@ -93,42 +111,100 @@ class EpidemicSim:
         individuals have spent at the location together.
     '''
 
-    def will_die(self, age, gender):
+    def death_probability(self, age, gender):
         multiplier = self.config['death_ratio_gender'][gender] * 2
         for k in self.config['deaths_by_age'].keys():
             if int(age) > int(k):
                 break
-        return random.random() < (self.config['deaths_by_age'][int(k)] * multiplier)
+        return self.config['deaths_by_age'][int(k)] * multiplier
+
+    def will_die(self, age, gender):
+        return self.rng.random() < self.death_probability(age, gender)
 
     def get_infection_on_interaction(self):
         if self.config['social_distancing']:
             return self.config['infection_on_interaction'] * self.config['social_distancing_infection_rate']
         return self.config['infection_on_interaction']
 
+    # key of this class in engines
+    engine = 'graph'
+    # values of config['transmission'] this class supports
+    transmissions = tuple(kernels)
+
     def __init__(self, graph, plot, config={}):
         self.config = {**default_config, **config}
-        self.G = graph
+        if self.config['transmission'] not in self.transmissions:
+            raise ValueError(f"the {self.engine} engine does not support {self.config['transmission']} transmission")
+        self.G = self._graph(graph)
         self.plot = plot
-        self.days = config['days']
+        self.days = self.config['days']
 
         rv = norm(scale=3)
         weights = []
         for i in range(2, 14):
             weights.append(rv.pdf(i - 8))
-        self.sampleIncubation = lambda: random.choices(
-            list(range(2, 14)), k=1, weights=weights)[0]
+        self.incubation_table = AliasTable(weights, np.arange(2, 14))
 
         rv = norm(scale=6)
         weights = []
         for i in range(14, 26):
             weights.append(rv.pdf(i - 20))
-        self.sampleInfectionLength = lambda: random.choices(
-            list(range(14, 26)), k=1, weights=weights)[0]
+        self.infection_length_table = AliasTable(weights, np.arange(14, 26))
 
-        self.people = list(filter(lambda n: str(n).startswith('P_'), self.G.nodes()))
+        self.people = self._find_people()
+        self.index = {p: i for i, p in enumerate(self.people)}
+        self.streams = RandomStreams(self.config['seed']).spawn(REPLICATE, self.config['replicate'])
+        self.rng = self.streams.generator(SETUP)
+        self.day = 0
+        self.history = []
+        self.checkpointer = None
+        # output.Sink instances that get a record of every day, and where
+        # verbose runs print
+        self.sinks = []
+        self.console = ConsoleSink()
         self.confirmed = 0
+        self.last_confirmed = 0
+        self.compartment_counts = np.zeros(len(COMPARTMENTS), dtype=np.int64)
+        # ids of the people in E, I or Q, the only ones whose state can progress
+        self.active = set()
+
+    def sampleIncubation(self):
+        return self.incubation_table.draw(self.rng)
+
+    def sampleInfectionLength(self):
+        return self.infection_length_table.draw(self.rng)
+
+    def counts(self):
+        '''Number of people currently in each compartment, keyed by letter.'''
+        return dict(zip(COMPARTMENTS, self.compartment_counts.tolist()))
+
+    def _graph(self, graph):
+        '''graph as this engine keeps it: a NetworkX graph, whose nodes hold everyone's state.'''
+        return graph.to_networkx() if isinstance(graph, VisitGraph) else graph
+
+    def _find_people(self):
+        return list(filter(lambda n: str(n).startswith('P_'), self.G.nodes()))
+
+    def _use_stream(self, *key):
+        '''Draw from the stream for key (see seeding.py) until told otherwise.'''
+        self.rng = self.streams.generator(*key)
+
+    def _current_stream(self):
+        '''Whatever _use_stream last set, for _restore_stream to switch back to.'''
+        return self.rng
+
+    def _restore_stream(self, stream):
+        self.rng = stream
 
     def update_state(self, node, state):
+        old = self.G.nodes[node].get('state')
+        if old is not None:
+            self.compartment_counts[COMPARTMENTS.index(old)] -= 1
+        self.compartment_counts[COMPARTMENTS.index(state)] += 1
+        if state in ('E', 'I', 'Q'):
+            self.active.add(self.index[node])
+        else:
+            self.active.discard(self.index[node])
         nx.set_node_attributes(self.G, {node: {'state': state}})
         # if they're exposed, we want a timeline until they show symptoms, and estimates
         # on virus length and death
@@ -144,7 +220,7 @@ class EpidemicSim:
             nx.set_node_attributes(self.G, {node: {
                 'test_submitted': False,
                 'days_since_submitted_test': 0,
-                'test_turnaround': random.randint(1, 4)
+                'test_turnaround': int(self.rng.integers(1, 5))
             }})
 
     def increment_time(self, node):
@@ -170,17 +246,50 @@ class EpidemicSim:
         nodes = self.get_people()
         return [attr[n] for n in nodes]
 
+    def export_state(self):
+        '''Per-person disease state as a state.PersonState, in self.people order.'''
+        st = PersonState(len(self.people))
+        for i, n in enumerate(self.people):
+            attrs = self.get_attrs(n)
+            st.state[i] = COMPARTMENTS.index(attrs['state'])
+            for field in PersonState.fields:
+                if field != 'state':
+                    getattr(st, field)[i] = attrs.get(field, 0)
+        return st
+
+    def import_state(self, st):
+        '''Replace everyone's disease state with st, as returned by export_state.'''
+        self.reset()
+        for i, n in enumerate(self.people):
+            attrs = {'state': COMPARTMENTS[st.state[i]]}
+            for field in PersonState.fields:
+                if field != 'state':
+                    attrs[field] = getattr(st, field)[i].item()
+            self.get_attrs(n).update(attrs)
+        self.compartment_counts[:] = np.bincount(st.state, minlength=len(COMPARTMENTS))
+        self.active = set(np.flatnonzero((st.state == E) | (st.state == I) | (st.state == Q)).tolist())
+
     def _run_one_iter(self, interactions):
         '''
         For each interaction in the graph
 
         acttype can be one of:
         (H)ome, (W)ork, (S)hop, s(C)hool, and (O)ther
+
+        Only active people are visited, in the same order as self.people,
+        since nobody else's state changes before transmission.
         '''
-        for n in self.get_people():
+        with profiler.phase('day.progress'):
+            self._progress()
+        with profiler.phase('day.transmit'):
+            self._transmit(interactions)
+
+    def _progress(self):
+        for i in sorted(self.active):
+            n = self.people[i]
             n_attrs = self.get_attrs(n)
             state = self.get_state(n)
-            if state is 'E' or state is 'I' or state is 'Q':
+            if state in ('E', 'I', 'Q'):
                 self.increment_time(n)
                 if n_attrs['infection_length'] <= n_attrs['time_infected']:
                     if n_attrs['will_die']:
@@ -198,11 +307,24 @@ class EpidemicSim:
                     if n_attrs['days_since_submitted_test'] == n_attrs['test_turnaround']:
                         self.update_state(n, 'Q')
                         self.confirmed += 1
-                elif random.random() < self.config['test_rate']:
+                elif self.rng.random() < self.config['test_rate']:
                     self.set_attr(n, 'test_submitted', True)
 
+    def _transmit(self, interactions):
+        if self.config['transmission'] != 'sequential':
+            states = np.array([COMPARTMENTS.index(s) for s in self.get_all_states()])
+            u, v = index_interactions(interactions, self.index)
+            exposed = kernels[self.config['transmission']](
+                states, u, v, self.get_infection_on_interaction(), lambda owners: self.rng.random(len(owners)))
+            for n in exposed:
+                self.update_state(self.people[n], 'E')
+            return
+
         # after checking all states, we iterate through interactions
-        for u, v, time, acttype in interactions:
+        draws = self.rng.random(len(interactions)).tolist()
+        people = interactions.people
+        for a, b, draw in zip(interactions.u.tolist(), interactions.v.tolist(), draws):
+            u, v = people[a], people[b]
             u_state = self.get_state(u)
             v_state = self.get_state(v)
 
@@ -210,54 +332,111 @@ class EpidemicSim:
             if u_state != 'S' and v_state != 'S':
                 continue
 
-            if random.random() < self.get_infection_on_interaction():
+            if draw < self.get_infection_on_interaction():
                 if u_state == 'I' and v_state == 'S':
                     self.update_state(v, 'E')
                 elif u_state == 'S' and v_state == 'I':
                     self.update_state(u, 'E')
 
-    def run_full_simulation(self, days, totalPeople):
-        # Sort edges of graph by timestep
+    def _day_record(self):
+        '''Today's record for the sinks (see output.py).'''
+        c = self.counts()
+        # everyone who has left S since the previous record was exposed
+        susceptible = self.history[-2][S] if len(self.history) > 1 else len(self.people)
+        return {
+            'day': self.day,
+            **c,
+            'new_exposed': int(susceptible - c['S']),
+            'new_confirmed': int(self.confirmed - self.last_confirmed),
+            'confirmed': int(self.confirmed),
+        }
 
-        potential_interactions = generate_interactions(self.G)
+    def _record_day(self, verbose):
+        '''
+        Log the compartment counts at the start of today in self.history and
+        hand today's record to the sinks. Returns whether the disease has
+        died out.
+        '''
+        profiler.day = self.day
+        with profiler.phase('day.record'):
+            return self._record(verbose)
+
+    def _record(self, verbose):
+        self.history.append(self.compartment_counts.copy())
+        console = self.console if verbose else None
+        if self.sinks or console is not None:
+            record = self._day_record()
+            for sink in self.sinks:
+                sink.write(record)
+            if console is not None:
+                console.write(record)
+        self.last_confirmed = self.confirmed
+        c = self.compartment_counts
+        return (c[E] + c[I] + c[Q]) == 0
+
+    def _flush_records(self, verbose):
+        for sink in self.sinks:
+            sink.flush()
+        if verbose and self.console is not None:
+            self.console.flush()
+
+    def _end_day(self):
+        self.day += 1
+        if self.checkpointer is not None:
+            with profiler.phase('day.checkpoint'):
+                self.checkpointer(self)
+
+    def simulate(self, potential_interactions, days, verbose=True):
+        '''
+        Advance the simulation from its current state for up to days days.
+
+        Returns the compartment counts at the start of every day simulated
+        since start() (one row per day, columns in COMPARTMENTS order) and
+        whether the disease died out before running out of days.
+        '''
+        if isinstance(potential_interactions, ShardedInteractions):
+            raise ValueError(f'the {self.engine} engine needs the potential interactions in memory, not in shards')
         finished = False
-        infected = []
-        recovered = []
-        dead = []
-        for day in range(days):
-            states = np.array(self.get_all_states())
-            interactions = sample_interactions(
-                self,
-                potential_interactions,
-                self.config['percent_interaction'],
-                self.config['distancing'])
-            print(f"Day {day + 1}\t" +
-                  f"S: {(states == 'S').sum()}" +
-                  f"\tE: {(states == 'E').sum()}" +
-                  f"\tI: {(states == 'I').sum()}" +
-                  f"\tQ: {(states == 'Q').sum()}" +
-                  f"\tR: {(states == 'R').sum()}" +
-                  f"\tD: {(states == 'D').sum()}")
-            infected.append((states == 'E').sum() + (states == 'I').sum() + (states == 'Q').sum())
-            recovered.append((states == 'R').sum())
-            dead.append((states == 'D').sum())
-            if ((states == 'E').sum() + (states == 'I').sum() + (states == 'Q').sum()) == 0:
+        for _ in range(days):
+            if self._record_day(verbose):
                 finished = True
                 break
+            self._use_stream(DAY, self.day)
+            with profiler.phase('day.sample'):
+                interactions = sample_interactions(
+                    self,
+                    potential_interactions,
+                    self.config['percent_interaction'],
+                    self.config['distancing'])
             self._run_one_iter(interactions)
+            self._end_day()
+        self._flush_records(verbose)
+        return np.array(self.history), finished
+
+    def run_full_simulation(self, days, totalPeople, potential_interactions=None):
+        # Sort edges of graph by timestep
 
-        states = np.array(self.get_all_states())
+        if potential_interactions is None and needs_interactions(self.config):
+            with profiler.phase('generate_interactions'):
+                potential_interactions = generate_interactions(self.G)
+        history, finished = self.simulate(potential_interactions, days)
+        infected = history[:, E] + history[:, I] + history[:, Q]
+        recovered = history[:, R]
+        dead = history[:, D]
+        day = len(history) - 1
+
+        c = self.counts()
         if finished:
-            D = (states == 'D').sum()
-            R = (states == 'R').sum()
-            S = (states == 'S').sum()
+            n_dead = c['D']
+            n_recovered = c['R']
+            n_uninfected = c['S']
             print('\nSummary:')
             print(f'\tDays to End: \t\t{day}')
             print(f'\tPeak Infections: \t{max(infected)}')
-            print(f'\tInfected Death Rate: \t{(D/(R+D)) * 100:.2f}%')
-            print(f'\tPop Death Rate: \t{(D/totalPeople) * 100:.2f}%')
-            print(f'\tRecovery Rate: \t\t{(R/(R+D)) * 100:.2f}%')
-            print(f'\tUninfected: \t\t{(S/totalPeople) * 100:.2f}%')
+            print(f'\tInfected Death Rate: \t{(n_dead/(n_recovered+n_dead)) * 100:.2f}%')
+            print(f'\tPop Death Rate: \t{(n_dead/totalPeople) * 100:.2f}%')
+            print(f'\tRecovery Rate: \t\t{(n_recovered/(n_recovered+n_dead)) * 100:.2f}%')
+            print(f'\tUninfected: \t\t{(n_uninfected/totalPeople) * 100:.2f}%')
 
             if self.plot:
                 import matplotlib.pyplot as plt
@@ -268,62 +447,551 @@ class EpidemicSim:
                 plt.xlabel('Days')
                 plt.show()
         else:
-            print(f'Did not remove COVID-19 in {days} days')
+            print(f'Did not remove COVID-19 in {self.day} days')
+
+    def fork(self, overrides={}):
+        '''
+        A copy of this simulation as it stands today, with its config changed
+        by overrides (see apply_overrides), that can then be advanced on its
+        own. The history so far is shared with the child rather than copied.
+
+        A child keeps drawing from the same random streams (see seeding.py),
+        so a fork without overrides follows the same trajectory as its
+        parent and differences between children come from the overrides.
+        '''
+        child = copy.copy(self)
+        child.config = apply_overrides(self.config, overrides)
+        child.days = child.config['days']
+        # rows of history are never modified, only appended
+        child.history = list(self.history)
+        child.compartment_counts = self.compartment_counts.copy()
+        child.confirmed = copy.copy(self.confirmed)
+        child.checkpointer = None
+        child.sinks = []
+        child._fork_state()
+        return child
+
+    def _fork_state(self):
+        self.G = self.G.copy()
+        self.active = set(self.active)
+
+    def reset(self):
+        nx.set_node_attributes(self.G, 'S', 'state')
+        nx.set_node_attributes(self.G, 0, 'time_infected')
+        self.active = set()
+        self.compartment_counts[:] = 0
+        self.compartment_counts[S] = len(self.people)
 
-    def run(self):
+    def start(self):
+        '''Make everyone susceptible, then infect the first person.'''
+        self.reset()
+        self.day = 0
+        self.history = []
+        self.confirmed = 0
+        self.last_confirmed = 0
+        self._use_stream(SETUP)
+        patient_zero = self.people[self.rng.integers(len(self.people))]
+        self.update_state(patient_zero, 'E')
+        self.update_state(patient_zero, 'I')
+
+    def run(self, potential_interactions=None):
         print('\n-- EPIDEMIC SIMULATION --')
         print("Config:")
         pprint.pprint(self.config)
-        nx.set_node_attributes(self.G, 'S', 'state')
-        nx.set_node_attributes(self.G, 0, 'time_infected')
 
         if self.config['social_distancing']:
             print("\nSOCIAL DISTANCING ENABLED. Infection rate multipler = " + str(self.config['social_distancing_infection_rate']))
 
         total = len(self.get_people())
-        # infect the first person
-        patient_zero = random.choice(self.get_people())
-        self.update_state(patient_zero, 'E')
-        self.update_state(patient_zero, 'I')
+        self.start()
 
         print(f'\nGenerating daily routines...')
-        self.run_full_simulation(self.days, total)
+        self.run_full_simulation(self.days, total, potential_interactions)
+
+
+class ArrayEpidemicSim(EpidemicSim):
+    '''
+    The same SEIQRD model as EpidemicSim, but per-person state lives in typed
+    NumPy arrays (see state.PersonState) indexed by a dense person id, the
+    position of the person in self.people.
+
+    The graph is only read at setup to collect people and their demographics.
+    Each day's disease progression is applied to the whole population at once
+    with boolean masks, following the same rules (and the same order of
+    rules) as EpidemicSim._run_one_iter.
+
+    population, when given, is a (people, ages, sexes) tuple as returned by
+    graph_population, and the graph is not read at all.
+
+    simulate works on the potential interactions as arrays of person indices:
+    each day is a progression phase, an interaction sample drawn as one
+    Bernoulli mask, and a transmission phase, each with its own random stream
+    (see seeding.py). Random draws go through _uniform, _choice and _integers
+    so that BatchEpidemicSim can route them to each replicate's own streams.
+
+    With the 'infectious' transmission, the sample and transmission phases
+    are replaced by one that only looks at the potential interactions of
+    people who are infectious today (see _transmit_infectious), so the cost
+    of a day follows the size of the epidemic rather than the number of
+    potential interactions.
+
+    The 'location' transmission needs no potential interactions at all.
+    Visits are binned into time slots (see transmission.LocationSlots) and
+    every susceptible is exposed with a hazard that follows the infectious
+    person-minutes they share a location with (see _transmit_location), so
+    the cost of a day is linear in the number of visits, even at locations
+    whose visitors would make up millions of pairs.
+    '''
+
+    engine = 'array'
+    transmissions = (*kernels, 'infectious', 'location')
+
+    def __init__(self, graph, plot, config={}, population=None):
+        graph = self._graph(graph)
+        if population is None:
+            population = graph_population(graph)
+        self.population = population
+        super().__init__(graph, plot, config)
+        people, ages, sexes = population
+        # people of the same age and sex share a death rate
+        groups, inverse = np.unique(np.stack([ages, sexes]), axis=1, return_inverse=True)
+        rates = np.array([self.death_probability(age, str(sex)) for age, sex in groups.T])
+        self.death_rate = rates[inverse.reshape(-1)]
+        self.state = PersonState(len(self.people))
+        # visits binned into time slots, built on first use by the 'location' transmission
+        self.slots = None
+        # graph_visits of the graph, given instead of it by simulators built without one
+        self.visits = None
+        self._reset_schedule()
+
+    def _graph(self, graph):
+        '''graph as a VisitGraph, which is only read, if at all.'''
+        return graph if graph is None else as_visit_graph(graph)
+
+    def _find_people(self):
+        return list(self.population[0])
+
+    def reset(self):
+        self.state = PersonState(len(self.people))
+        self.confirmed = 0
+        self.compartment_counts[:] = 0
+        self.compartment_counts[S] = len(self.people)
+        self._reset_schedule()
+
+    def _reset_schedule(self):
+        # the last day whose progression has been applied: a timer that reads
+        # k now reads k + j on day clock + j
+        self.clock = -1
+        self.schedule = Scheduler()
+        # people in E, I or Q, and people in I who have not asked for a test
+        self.active = np.zeros(0, dtype=np.int64)
+        self.untested = np.zeros(0, dtype=np.int64)
+
+    def _schedule_all(self):
+        '''Rebuild the schedule from the timers in self.state, at the start of self.day.'''
+        self._reset_schedule()
+        st = self.state
+        self.clock = self.day - 1
+        state = st.state
+        self.active = np.flatnonzero((state == E) | (state == I) | (state == Q))
+        a = self.active
+        # someone confirmed on the day they recovered or died is removed the next day
+        self.schedule.push(np.maximum(self.clock + st.infection_length[a] - st.time_infected[a], self.day), a)
+        exposed = np.flatnonzero(state == E)
+        self.schedule.push(self.clock + st.incubation[exposed] - st.time_infected[exposed], exposed)
+        waiting = np.flatnonzero((state == I) & st.test_submitted)
+        self.schedule.push(
+            self.clock + st.test_turnaround[waiting] - st.days_since_submitted_test[waiting], waiting)
+        self.untested = np.flatnonzero((state == I) & ~st.test_submitted)
+
+    def _fork_state(self):
+        self.state = self.state.copy()
+        self.schedule = self.schedule.copy()
+
+    def _move(self, idx, code):
+        '''Put the people at idx into compartment code, keeping the counters in step.'''
+        self.compartment_counts -= np.bincount(self.state.state[idx], minlength=len(COMPARTMENTS))
+        self.compartment_counts[code] += len(idx)
+        self.state.state[idx] = code
+
+    def _confirm(self, idx):
+        self._move(idx, Q)
+        self.confirmed += len(idx)
+
+    def _uniform(self, idx):
+        '''One uniform draw for each person in idx.'''
+        return self.rng.random(len(idx))
+
+    def _choice(self, idx, table):
+        '''One draw from table (a sampling.AliasTable) for each person in idx.'''
+        return table.draw(self.rng, len(idx))
+
+    def _integers(self, idx, low, high):
+        '''One integer in [low, high) for each person in idx.'''
+        return self.rng.integers(low, high, size=len(idx))
+
+    def _expose(self, idx):
+        st = self.state
+        self._move(idx, E)
+        st.will_die[idx] = self._uniform(idx) < self.death_rate[idx]
+        st.incubation[idx] = self._choice(idx, self.incubation_table)
+        st.time_infected[idx] = 0
+        st.infection_length[idx] = self._choice(idx, self.infection_length_table)
+        self.schedule.push(self.clock + st.incubation[idx], idx)
+        self.schedule.push(self.clock + st.infection_length[idx], idx)
+        self.active = np.union1d(self.active, idx)
+
+    def _infect(self, idx):
+        st = self.state
+        self._move(idx, I)
+        st.test_submitted[idx] = False
+        st.days_since_submitted_test[idx] = 0
+        st.test_turnaround[idx] = self._integers(idx, 1, 5)
+        self.untested = np.union1d(self.untested, idx)
+
+    def update_state(self, node, state):
+        idx = np.array([self.index[node]])
+        if state == 'E':
+            self._expose(idx)
+        elif state == 'I':
+            self._infect(idx)
+        else:
+            self._move(idx, COMPARTMENTS.index(state))
+
+    def get_state(self, node):
+        return COMPARTMENTS[self.state.state[self.index[node]]]
+
+    def get_all_states(self):
+        return self.state.letters()
+
+    def export_state(self):
+        return self.state
+
+    def import_state(self, st):
+        '''Replace everyone's disease state with st, as of the start of self.day.'''
+        self.state = st
+        self.compartment_counts[:] = np.bincount(st.state, minlength=len(COMPARTMENTS))
+        self._schedule_all()
+
+    def _progress(self):
+        '''
+        Apply today's disease progression. Only the timers of active people
+        move, and only the people the schedule has due today (plus those in
+        I deciding whether to get tested) are checked against the rules.
+        '''
+        st = self.state
+        self.clock = self.day
+        active, untested = self.active, self.untested
+        due = self.schedule.pop(self.day)
+        # every rule below looks at the state people were in at the start of the day
+        state = st.state[due]
+        waiting = active[(st.state[active] == I) & st.test_submitted[active]]
+
+        st.time_infected[active] += 1
+        infected = (state == E) | (state == I) | (state == Q)
+        done = due[infected & (st.infection_length[due] <= st.time_infected[due])]
+        dies = st.will_die[done]
+        self._move(done[dies], D)
+        self._move(done[~dies], R)
+
+        onset = due[(state == E) & (st.incubation[due] == st.time_infected[due])]
+        self._infect(onset)
+
+        # determine whether they should quarantine
+        st.days_since_submitted_test[waiting] += 1
+        positive = (state == I) & st.test_submitted[due] & \
+            (st.days_since_submitted_test[due] == st.test_turnaround[due])
+        self._confirm(due[positive])
+        tested = untested[self._uniform(untested) < self.config['test_rate']]
+        st.test_submitted[tested] = True
+        self.schedule.push(self.day + st.test_turnaround[tested], tested)
+
+        # confirmed on the day they were removed: removed again tomorrow
+        self.schedule.push(self.day + 1, done[st.state[done] == Q])
+        state = st.state[self.active]
+        self.active = self.active[(state == E) | (state == I) | (state == Q)]
+        self.untested = self.untested[(st.state[self.untested] == I) & ~st.test_submitted[self.untested]]
+
+    def _transmit_contacts(self, u, v):
+        exposed = kernels[self.config['transmission']](
+            self.state.state, u, v, self.get_infection_on_interaction(), self._uniform)
+        self._expose(exposed)
+
+    def _transmit(self, interactions):
+        u, v = index_interactions(interactions, self.index)
+        self._transmit_contacts(u, v)
+
+    def _distanced(self):
+        '''
+        Whether the distancing protocol currently applies. A day's sample
+        follows the protocol as of the start of the day, before progression
+        confirms anyone (as in EpidemicSim.simulate, which samples before
+        _run_one_iter), so _step reads it first and hands it on.
+        '''
+        return not self.config['distancing']['enable_after_confirmed'] or self.confirmed > 0
+
+    def _sample(self, codes, distanced):
+        '''
+        Mask of the potential interactions that happen today. Each happens with
+        probability percent_interaction, times the chance its activity type
+        still occurs when the distancing protocol applies (distanced, as
+        _distanced had it at the start of the day), as in
+        interaction.sample_interactions.
+        '''
+        p = self.config['percent_interaction']
+        if distanced:
+            p = p * activity_probabilities(self.config['distancing'])[codes]
+        return self.rng.random(len(codes)) < p
+
+    def _contacts(self, u, v, sampled):
+        '''Person indices of the potential interactions picked by a _sample mask.'''
+        k = np.flatnonzero(sampled)
+        return u[k], v[k]
+
+    def _transmit_infectious(self, u, v, codes, distanced):
+        '''
+        Sample and evaluate only the potential interactions between an
+        infectious and a susceptible person. Each happens and transmits with
+        probability percent_interaction (times its activity's chance under
+        distancing) times the infection rate, one draw per interaction, so
+        every susceptible gets the same chance of exposure as with _sample
+        followed by a kernel.
+        '''
+        st = self.state
+        n = len(self.people)
+        infectious = self.active[st.state[self.active] == I]
+        k, owner = self.incidence.gather(infectious % n)
+        # flat ids, so that batches of replicates (see batch.py) work too
+        source = infectious[owner]
+        offset = source - source % n
+        other = np.where(u[k] == source % n, v[k], u[k]) + offset
+        susceptible = st.state[other] == S
+        k, other = k[susceptible], other[susceptible]
+
+        p = self.config['percent_interaction'] * self.get_infection_on_interaction()
+        act_p = activity_probabilities(self.config['distancing'])[codes[k]]
+        p = np.where(np.atleast_1d(distanced)[other // n], p * act_p, p)
+        self._expose(np.unique(other[self._uniform(other) < p]))
+
+    def _transmit_location(self, distanced):
+        '''
+        Expose every susceptible with probability 1 - exp(-h). Each of their
+        visits adds to the hazard h the infectious person-minutes it shares
+        (see LocationSlots.exposure), counted in units of contact_minutes,
+        times -log(1 - q), where q is what one potential interaction at it
+        transmits with in the other transmissions: percent_interaction times
+        the infection rate, times its activity's chance under distancing.
+        So a susceptible that spends contact_minutes next to one infectious
+        person is exposed with probability q, and the chances of separate
+        encounters combine as independent ones would.
+        '''
+        slots = self.slots
+        n = len(self.people)
+        states = self.state.state.reshape(-1, n)
+        replicates = len(states)
+        visitors = states[:, slots.person]
+        exposure = slots.exposure(visitors == I)
+
+        q = self.config['percent_interaction'] * self.get_infection_on_interaction()
+        act_p = activity_probabilities(self.config['distancing'])[self.slot_codes]
+        q = np.where(np.atleast_1d(distanced)[:, np.newaxis], q * act_p, q)
+        rate = -np.log1p(-np.minimum(q, 1 - 1e-12)) / self.config['contact_minutes']
+        weights = np.where(visitors == S, exposure * rate, 0)
+        owner = (np.arange(replicates)[:, np.newaxis] * n + slots.person).reshape(-1)
+        hazard = np.bincount(owner, weights=weights.reshape(-1), minlength=replicates * n)
+
+        candidates = np.flatnonzero(hazard > 0)
+        p = -np.expm1(-hazard[candidates])
+        self._expose(candidates[self._uniform(candidates) < p])
+
+    def _transmit_chunks(self, chunks, distanced):
+        '''
+        Sample the potential interactions and run the kernel over the
+        contacts chunk by chunk (see transmission.chunked), so only one
+        chunk's worth is in memory at a time. The draws are the same as
+        over all the chunks at once: the sample and the kernel keep to
+        their own streams, which are switched between for every chunk.
+        '''
+        self._use_stream(DAY, self.day, SAMPLE)
+        sample = self._current_stream()
+        self._use_stream(DAY, self.day, TRANSMIT)
+        transmit = self._current_stream()
+
+        def contacts():
+            for u, v, codes in chunks:
+                self._restore_stream(sample)
+                with profiler.phase('day.sample'):
+                    sampled = self._sample(codes, distanced)
+                self._restore_stream(transmit)
+                yield self._contacts(u, v, sampled)
+
+        exposed = chunked(self.config['transmission'], self.state.state, contacts(),
+                          self.get_infection_on_interaction(), self._uniform)
+        self._expose(exposed)
+
+    def _prepare(self, chunks):
+        '''Set up whatever the day loop needs for these chunks of potential interactions.'''
+        self.incidence = None
+        if self.config['transmission'] == 'infectious':
+            if len(chunks) != 1:
+                raise ValueError('infectious transmission needs the potential interactions in memory, not in shards')
+            (u, v, codes), = chunks
+            self.incidence = Incidence(u, v, len(self.people))
+        slot = self.config['slot_minutes']
+        if self.config['transmission'] == 'location' and (self.slots is None or self.slots.slot != slot):
+            if self.G is None and self.visits is None:
+                raise ValueError('location transmission needs the graph the population was read from')
+            with profiler.phase('location_slots'):
+                visits = self.visits if self.visits is not None else graph_visits(self.G, self.index)
+                person, location, start, end, self.slot_codes = visits
+                self.slots = LocationSlots(person, location, start, end, slot)
+
+    def _step(self, chunks):
+        distanced = self._distanced()
+        self._use_stream(DAY, self.day, PROGRESS)
+        with profiler.phase('day.progress'):
+            self._progress()
+        if self.config['transmission'] in ('infectious', 'location'):
+            self._use_stream(DAY, self.day, TRANSMIT)
+            with profiler.phase('day.transmit'):
+                if self.config['transmission'] == 'infectious':
+                    self._transmit_infectious(*next(iter(chunks)), distanced)
+                else:
+                    self._transmit_location(distanced)
+            return
+        if len(chunks) > 1:
+            # the time of day.sample is counted in day.transmit here
+            with profiler.phase('day.transmit'):
+                self._transmit_chunks(chunks, distanced)
+            return
+        (u, v, codes), = chunks
+        self._use_stream(DAY, self.day, SAMPLE)
+        with profiler.phase('day.sample'):
+            sampled = self._sample(codes, distanced)
+        self._use_stream(DAY, self.day, TRANSMIT)
+        with profiler.phase('day.transmit'):
+            self._transmit_contacts(*self._contacts(u, v, sampled))
+
+    def simulate(self, potential_interactions, days, verbose=True):
+        '''
+        EpidemicSim.simulate. The potential interactions may also be a
+        ShardedInteractions table, gone through shard by shard every day,
+        or None for the 'location' transmission, which does without them.
+        '''
+        if potential_interactions is None:
+            potential_interactions = Interactions.empty()
+        ids = people_ids(potential_interactions.people, self.index)
+        return self.simulate_chunks(InteractionChunks(potential_interactions, ids), days, verbose)
+
+    def simulate_arrays(self, u, v, codes, days, verbose=True):
+        '''
+        simulate, for potential interactions already given as arrays of person
+        indices (u, v) and activity codes (see interaction.Interactions).
+        '''
+        return self.simulate_chunks([(u, v, codes)], days, verbose)
+
+    def simulate_chunks(self, chunks, days, verbose=True):
+        '''
+        simulate, for potential interactions given as a sequence of (u, v,
+        codes) chunks of arrays (see interaction.InteractionChunks), which
+        is gone through once every day.
+        '''
+        self._prepare(chunks)
+        finished = False
+        for _ in range(days):
+            if self._record_day(verbose):
+                finished = True
+                break
+            self._step(chunks)
+            self._end_day()
+        self._flush_records(verbose)
+        return np.array(self.history), finished
+
+
+def needs_interactions(config):
+    '''Whether simulations with config run on the potential interactions.'''
+    return config.get('transmission') != 'location'
+
+
+def apply_overrides(config, overrides):
+    '''
+    config with the values in overrides replaced. Keys may reach into the
+    distancing protocol with a dot, e.g. 'distancing.W'.
+    '''
+    config = {**config, 'distancing': dict(config['distancing'])}
+    for key, value in overrides.items():
+        if key.startswith('distancing.'):
+            config['distancing'][key[len('distancing.'):]] = value
+        else:
+            config[key] = value
+    return config
+
+
+def graph_population(G):
+    '''
+    People of G along with their ages and sexes as arrays, in the order
+    EpidemicSim.people lists them.
+    '''
+    G = as_visit_graph(G)
+    ages = np.array(G.person_attrs['age'], dtype=np.int64).astype(np.int16)
+    sexes = np.array(G.person_attrs['sex'], dtype=np.int64).astype(np.int8)
+    return list(G.people), ages, sexes
+
+
+engines = {
+    'graph': EpidemicSim,
+    'array': ArrayEpidemicSim,
+}
 
 
 def generate_graph(synth_hhs):
     '''
-    Generate an undirected, multi-edge, bipartite graph using nx.MultiGraph().
+    Generate the bipartite person-location graph of the households, as a
+    VisitGraph (see visit_graph.py) built in one pass.
     '''
-    person_count = 0
-    G = nx.MultiGraph()
+    people, locations = [], []
+    person_attrs, location_attrs = {}, {}
+    index = {}
+    codes = {t: i for i, t in enumerate(activity_types)}
+    person, location, start, end, acttype = (array(t) for t in 'iihhB')
     for syn_hh in synth_hhs:
-        for person in syn_hh.people:
+        for syn_person in syn_hh.people:
 
             # Add person to graph
-            person_id = f"P_{person_count}"
-            G.add_node(person_id, **person.attr_dict())
-            person_count += 1
+            p = len(people)
+            people.append(f"P_{p}")
+            for name, value in syn_person.attr_dict().items():
+                person_attrs.setdefault(name, []).append(value)
 
-            # Add edge between person and location for each activity
-            for activity in person.activities:
+            # Add a visit to the location of each activity
+            for activity in syn_person.activities:
                 act_loc = activity.location
                 loc_id = f"L_{act_loc.id}"
 
-                # Add location to graph
-                if not G.has_node(act_loc.id):
-                    G.add_node(loc_id, **act_loc.attr_dict())
+                # Add location to graph, the first time it is visited
+                j = index.get(loc_id)
+                if j is None:
+                    j = index[loc_id] = len(locations)
+                    locations.append(loc_id)
+                    for name, value in act_loc.attr_dict().items():
+                        location_attrs.setdefault(name, []).append(value)
 
-                G.add_edge(person_id, loc_id, **activity.attr_dict())
+                attrs = activity.attr_dict()
+                person.append(p)
+                location.append(j)
+                start.append(attrs['starttime'])
+                end.append(attrs['endtime'])
+                acttype.append(codes[attrs['acttype']])
 
-    return G
+    return VisitGraph(people, locations, person, location, start, end, acttype, person_attrs, location_attrs)
 
 
 def parse_args(argv=None):
     argparser = argparse.ArgumentParser()
     argparser.add_argument('--graph-in', '-i', dest='graph_in', 
-        help='import a previously-generated synthetic population')
+        help='import a previously-generated synthetic population (GML, or binary, see graph_io.py)')
     argparser.add_argument('--graph-out', '-o', dest='graph_out',
-        help='export the to-be-generated synthetic population to a file')
+        help='export the to-be-generated synthetic population to a file (binary if it ends in .graph, else GML)')
     argparser.add_argument('--population-size', '-n', dest='n', type=int, default=1000,
         help='the size of the population')
     argparser.add_argument(
@@ -345,34 +1013,138 @@ def parse_args(argv=None):
         help='rate of infection upon interaction (w/o mask or distancing)')
     argparser.add_argument('--percent-interaction', '-pi', dest='pi', type=float, default=0.3,
         help='chance of interaction if two people are at the same location')
+    argparser.add_argument('--engine', dest='engine', choices=engines.keys(), default='graph',
+        help='where per-person state is kept: NetworkX node attributes or NumPy arrays')
+    argparser.add_argument('--transmission', dest='transmission', choices=ArrayEpidemicSim.transmissions, default='sequential',
+        help='transmission kernel: exact per-interaction draws, a sparse force-of-infection mat-vec, ' +
+             '(array engine) only the interactions of infectious people, ' +
+             'or (array engine) infectious time shared at each location, without potential interactions')
+    argparser.add_argument('--replicates', dest='replicates', type=int, default=1,
+        help='number of independent simulations to run on the same graph (ensemble mode if > 1)')
+    argparser.add_argument('--workers', dest='workers', type=int, default=1,
+        help='number of worker processes used to generate the potential interactions and run replicates')
+    argparser.add_argument('--data-dir', dest='data_dir',
+        help='build the population from the census, NHTS and parcel files in this directory ' +
+             '(see providers.py) instead of downloading them')
+    argparser.add_argument('--seed', dest='seed', type=int, default=None,
+        help='seed for every random draw, from building the population to each replicate')
+    argparser.add_argument('--batch-size', dest='batch_size', type=int, default=1,
+        help='advance this many replicates at once in a single vectorized state matrix (array engine)')
+    argparser.add_argument('--checkpoint', dest='checkpoint',
+        help='periodically save the state of the simulation to this file (single simulations only)')
+    argparser.add_argument('--checkpoint-every', dest='checkpoint_every', type=int, default=10,
+        help='save a checkpoint every this many days')
+    argparser.add_argument('--output', dest='output',
+        help='stream a record of every simulated day to this file (single simulations only)')
+    argparser.add_argument('--output-format', dest='output_format', choices=formats.keys(),
+        help='format of --output (parquet needs pyarrow); by default guessed from its extension')
+    argparser.add_argument('--print-every', dest='print_every', type=int, default=1,
+        help='print the compartment counts every this many days (0 to never print them)')
+    argparser.add_argument('--profile', dest='profile', action='store_true', default=False,
+        help='time every pipeline stage and simulation phase, and print a summary at exit')
+    argparser.add_argument('--profile-report', dest='profile_report', default='profile.json',
+        help='with --profile, write the timings (totals, calls and per-day times) to this JSON file')
+    argparser.add_argument('--cprofile', dest='cprofile',
+        help='with --profile, also run under cProfile and dump its stats to this file')
+    argparser.add_argument('--resume', dest='resume',
+        help='carry on from a checkpoint instead of starting over (the graph engine also needs -i)')
+    interaction_cache.add_arguments(argparser)
     # Simulation arguments
-    return argparser.parse_args(argv)
+    args = argparser.parse_args(argv)
+    if args.replicates > 1 and not args.resume:
+        # an ensemble only reports its summary (see ensemble.report)
+        for flag, value in (('--output', args.output), ('--checkpoint', args.checkpoint)):
+            if value:
+                argparser.error(f'{flag} follows a single simulation and cannot be used with --replicates > 1')
+    if args.batch_size > 1 and args.engine != 'array':
+        # batches are advanced by batch.BatchEpidemicSim, an array engine
+        argparser.error('--batch-size > 1 needs --engine array')
+    interaction_cache.check_arguments(argparser, args)
+    return args
 
 
-if __name__ == "__main__":
-    args = parse_args()
-
+def main(args):
     G = None
     if args.graph_in:
-        G = nx.read_gml(args.graph_in)
-    else:
-        synth_hhs = generate_synthetic(args.n)
+        with profiler.phase('load_graph'):
+            G = read_graph(args.graph_in)
+    elif not args.resume:
+        if args.data_dir:
+            set_provider(OfflineProvider(args.data_dir))
+        with profiler.phase('generate_population'):
+            synth_hhs = generate_synthetic(args.n, args.seed)
 
         print("Generating environment interaction graph.")
-        G = generate_graph(synth_hhs)
+        with profiler.phase('generate_graph'):
+            G = generate_graph(synth_hhs)
 
         if args.graph_out:
             print(f"Writing generated graph to {args.graph_out}")
-            nx.write_gml(G, args.graph_out)
+            with profiler.phase('write_graph'):
+                write_graph(G, args.graph_out)
 
-    # Run simulation
-    sim = EpidemicSim(G, args.p, {
+    potential_interactions = None
+    if not args.resume and needs_interactions(vars(args)):
+        potential_interactions = interaction_cache.from_args(G, args.graph_in or args.graph_out, args)
+
+    config = {
         'infection_on_interaction': args.ir,
         'percent_interaction': args.pi,
         'social_distancing_infection_rate': args.sdrate,
         'social_distancing': args.sd,
         'test_rate': args.t,
+        'transmission': args.transmission,
+        'seed': args.seed,
         'days': args.maxdays
-    })
-    sim.run()
-    
+    }
+
+    if args.replicates > 1 and not args.resume:
+        from ensemble import run_ensemble, report
+        print(f'\n-- EPIDEMIC ENSEMBLE ({args.replicates} replicates) --')
+        histories, elapsed = run_ensemble(
+            G, args.engine, config, args.replicates, args.workers, args.seed, args.batch_size,
+            potential_interactions)
+        report(histories, elapsed, args.workers, args.p)
+    else:
+        if args.resume:
+            from checkpoint import resume, Checkpointer
+            sim, potential_interactions = resume(args.resume, G, args.p)
+            if args.checkpoint:
+                # the interactions next to the checkpoint we resumed from can be reused
+                sim.checkpointer = Checkpointer(
+                    args.checkpoint, args.checkpoint_every,
+                    None if args.checkpoint == args.resume else potential_interactions)
+        else:
+            sim = engines[args.engine](G, args.p, config)
+            if args.checkpoint:
+                from checkpoint import Checkpointer
+                if potential_interactions is None and needs_interactions(config):
+                    with profiler.phase('generate_interactions'):
+                        potential_interactions = generate_interactions(G)
+                sim.checkpointer = Checkpointer(
+                    args.checkpoint, args.checkpoint_every, potential_interactions)
+
+        sim.console = ConsoleSink(args.print_every) if args.print_every > 0 else None
+        if args.output:
+            sim.sinks.append(open_sink(args.output, args.output_format,
+                                       resume=sim.day if args.resume else None))
+        try:
+            if args.resume:
+                print(f'\n-- EPIDEMIC SIMULATION (resumed on day {sim.day + 1}) --')
+                sim.run_full_simulation(sim.days - sim.day, len(sim.people), potential_interactions)
+            else:
+                sim.run(potential_interactions)
+        finally:
+            for sink in sim.sinks:
+                sink.close()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.profile:
+        profiler.enable(cprofile=args.cprofile is not None)
+    try:
+        main(args)
+    finally:
+        if args.profile:
+            profiler.finish(args.profile_report, args.cprofile)
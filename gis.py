@@ -1,7 +1,6 @@
 from typing import Tuple, Sequence
-import geopandas as gpd
 from tqdm import tqdm
-from util.webapi import init_gis
+from providers import get_provider
 
 Coordinates = Sequence[float]
 LandUse = str
@@ -67,14 +66,15 @@ class GastonCountyGIS:
         '2020', '2030', '2040', '2110']
     locations = list(set(workplaces + homes + schools + shopping))
 
-    init_gis()
-    shape_file = "data/ncgis/nc_gaston_parcels_pt.shp"
     _geodataframe = None
+    _provider = None
 
     @staticmethod
     def _load_data():
-        if GastonCountyGIS._geodataframe is None:
-            GastonCountyGIS._geodataframe = gpd.read_file(GastonCountyGIS.shape_file)
+        provider = get_provider()
+        if GastonCountyGIS._geodataframe is None or GastonCountyGIS._provider is not provider:
+            GastonCountyGIS._geodataframe = provider.parcels()
+            GastonCountyGIS._provider = provider
 
     @staticmethod
     def get_locations():
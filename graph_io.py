@@ -0,0 +1,233 @@
+import argparse
+import json
+import os
+import networkx as nx
+import numpy as np
+from visit_graph import VisitGraph, as_visit_graph, activity_types
+from util.files import temporary_dir, replace_dir
+
+'''
+    Reading and writing person-location graphs (see visit_graph.py), as
+    GML or in a binary format that loads many times faster.
+
+    A binary graph is a directory of typed NumPy arrays plus graph.json,
+    which describes them:
+
+        nodes.npy        every node name, people first, then locations
+        kinds.npy        per node, which attribute set (kind) it has
+        node.<k>.<a>.npy attribute a of the nodes of kind k, in node order
+        u.npy, v.npy     per visit, the positions of its person and its
+                         location in nodes.npy
+        keys.npy         per visit, its multigraph key
+        edge.<a>.npy     starttime, endtime and acttype of every visit
+
+    An attribute column is stored as integers when its values are
+    integers, or strings of integers as GML leaves age, income and sex.
+    Columns of other strings (loctype, acttype, coords) are stored as the
+    sorted distinct values plus a code per node or edge. Reading a graph
+    back gives the same VisitGraph as the one written, without building
+    any NetworkX objects.
+
+    read_graph and write_graph pick the format from the path: a directory,
+    or a path ending in .graph, is binary, and anything else is GML. So
+    epidemic.py -o data/graph.graph writes the binary format and -i reads
+    either one. read_graph always returns a VisitGraph.
+'''
+
+VERSION = 1
+
+extension = '.graph'
+
+
+def is_binary(path):
+    return os.path.isdir(path) or path.endswith(extension)
+
+
+def _encode(values):
+    '''
+    A column of values as (encoding, arrays): 'int' or 'str-int' (strings
+    of integers) as a single integer array, 'float' as a float array, and
+    'category' (anything else, as strings) as the codes and the values.
+    '''
+    if all(isinstance(x, (int, np.integer)) and not isinstance(x, bool) for x in values):
+        return 'int', [_smallest(np.array(values, dtype=np.int64))]
+    if all(isinstance(x, (float, np.floating)) for x in values):
+        return 'float', [np.array(values, dtype=np.float64)]
+    strings = [str(x) for x in values]
+    try:
+        ints = np.array([int(s) for s in strings], dtype=np.int64)
+        if all(str(i) == s for i, s in zip(ints.tolist(), strings)):
+            return 'str-int', [_smallest(ints)]
+    except ValueError:
+        pass
+    categories, codes = np.unique(np.array(strings), return_inverse=True)
+    # as UTF-8, a quarter of the size of NumPy's strings
+    return 'category', [_smallest(codes.reshape(-1)), np.array([c.encode() for c in categories.tolist()])]
+
+
+def _decode(encoding, arrays):
+    '''The values _encode took, as a list.'''
+    if encoding in ('int', 'float'):
+        return arrays[0].tolist()
+    if encoding == 'str-int':
+        return [str(i) for i in arrays[0].tolist()]
+    codes, categories = arrays
+    categories = [c.decode() for c in categories.tolist()]
+    return [categories[c] for c in codes.tolist()]
+
+
+def _smallest(ints):
+    '''ints in the narrowest integer type that holds all of them.'''
+    if len(ints) == 0:
+        return ints.astype(np.int8)
+    for dtype in (np.int8, np.int16, np.int32):
+        info = np.iinfo(dtype)
+        if info.min <= ints.min() and ints.max() <= info.max:
+            return ints.astype(dtype)
+    return ints
+
+
+def _save_column(path, name, values):
+    encoding, arrays = _encode(values)
+    np.save(os.path.join(path, name + '.npy'), arrays[0])
+    if encoding == 'category':
+        np.save(os.path.join(path, name + '.categories.npy'), arrays[1])
+    return encoding
+
+
+def _load_column(path, name, encoding):
+    arrays = [np.load(os.path.join(path, name + '.npy'))]
+    if encoding == 'category':
+        arrays.append(np.load(os.path.join(path, name + '.categories.npy')))
+    return _decode(encoding, arrays)
+
+
+def write_binary(G, path):
+    '''Write G (a VisitGraph, or a NetworkX graph of its shape) to the directory path, in the binary format.'''
+    G = as_visit_graph(G)
+    tmp = temporary_dir(path)
+    nodes = G.people + G.locations
+    np.save(os.path.join(tmp, 'nodes.npy'), np.array([str(n) for n in nodes]))
+
+    # the attribute names every node has a value for
+    kinds = {}
+    node_kind = []
+    for attrs, count in ((G.person_attrs, len(G.people)), (G.location_attrs, len(G.locations))):
+        columns = list(attrs.items())
+        for i in range(count):
+            names = tuple(name for name, values in columns if values[i] is not None)
+            node_kind.append(kinds.setdefault(names, len(kinds)))
+    node_kind = np.array(node_kind, dtype=np.int64)
+    np.save(os.path.join(tmp, 'kinds.npy'), _smallest(node_kind))
+    node_columns = []
+    for kind, names in enumerate(kinds):
+        members = np.flatnonzero(node_kind == kind).tolist()
+        columns = {}
+        for name in names:
+            people = G.person_attrs.get(name)
+            locations = G.location_attrs.get(name)
+            values = [people[i] if i < len(G.people) else locations[i - len(G.people)] for i in members]
+            columns[name] = _save_column(tmp, f'node.{kind}.{name}', values)
+        node_columns.append(columns)
+
+    # keys number the visits of each person to each location, in order
+    pair = G.location.astype(np.int64) * max(1, len(G.people)) + G.person
+    order = np.argsort(pair, kind='stable')
+    first = np.flatnonzero(np.r_[True, pair[order][1:] != pair[order][:-1]])
+    keys = np.empty(len(pair), dtype=np.int64)
+    keys[order] = np.arange(len(pair)) - np.repeat(first, np.diff(np.r_[first, len(pair)]))
+    np.save(os.path.join(tmp, 'u.npy'), G.person.astype(np.int32))
+    np.save(os.path.join(tmp, 'v.npy'), (G.location + len(G.people)).astype(np.int32))
+    np.save(os.path.join(tmp, 'keys.npy'), _smallest(keys))
+    edge_columns = {
+        'starttime': _save_column(tmp, 'edge.starttime', G.start.tolist()),
+        'endtime': _save_column(tmp, 'edge.endtime', G.end.tolist()),
+        'acttype': _save_column(tmp, 'edge.acttype', [activity_types[c] for c in G.acttype.tolist()]),
+    }
+
+    with open(os.path.join(tmp, 'graph.json'), 'w') as f:
+        json.dump({
+            'version': VERSION,
+            'kinds': [list(names) for names in kinds],
+            'node_columns': node_columns,
+            'edge_columns': edge_columns,
+        }, f)
+    replace_dir(tmp, path)
+
+
+def _scatter(attrs, name, size, positions, values):
+    '''Set attrs[name][positions] to values, attrs[name] being a list of size values.'''
+    if name not in attrs and len(positions) == size:
+        # the usual case, every node of a side having the attribute
+        attrs[name] = values
+        return
+    column = attrs.setdefault(name, [None] * size)
+    for i, value in zip(positions, values):
+        column[i] = value
+
+
+def read_binary(path):
+    '''The VisitGraph written to the directory path.'''
+    with open(os.path.join(path, 'graph.json')) as f:
+        meta = json.load(f)
+    if meta['version'] != VERSION:
+        raise ValueError(f"{path} is a version {meta['version']} graph, not version {VERSION}")
+    nodes = np.load(os.path.join(path, 'nodes.npy'))
+    node_kind = np.load(os.path.join(path, 'kinds.npy'))
+    person = np.char.startswith(nodes, 'P_')
+    # the position of every node among the people or among the locations
+    rank = np.empty(len(nodes), dtype=np.int64)
+    rank[person] = np.arange(person.sum())
+    rank[~person] = np.arange((~person).sum())
+    people, locations = nodes[person].tolist(), nodes[~person].tolist()
+
+    person_attrs, location_attrs = {}, {}
+    for kind, columns in enumerate(meta['node_columns']):
+        members = np.flatnonzero(node_kind == kind)
+        for name, encoding in columns.items():
+            values = _load_column(path, f'node.{kind}.{name}', encoding)
+            for attrs, side, size in ((person_attrs, person, len(people)), (location_attrs, ~person, len(locations))):
+                mine = side[members]
+                if mine.any():
+                    positions = rank[members[mine]].tolist()
+                    _scatter(attrs, name, size, positions,
+                             values if mine.all() else [x for x, m in zip(values, mine.tolist()) if m])
+
+    u = np.load(os.path.join(path, 'u.npy'))
+    v = np.load(os.path.join(path, 'v.npy'))
+    visitor = np.where(person[u], u, v)
+    place = np.where(person[u], v, u)
+    columns = meta['edge_columns']
+    start = np.array(_load_column(path, 'edge.starttime', columns['starttime']))
+    end = np.array(_load_column(path, 'edge.endtime', columns['endtime']))
+    codes = {t: i for i, t in enumerate(activity_types)}
+    acttype = np.array([codes[a] for a in _load_column(path, 'edge.acttype', columns['acttype'])], dtype=np.uint8)
+    return VisitGraph(people, locations, rank[visitor], rank[place], start, end, acttype,
+                      person_attrs, location_attrs)
+
+
+def read_graph(path):
+    '''The graph at path, in whichever format is_binary says it is, as a VisitGraph.'''
+    if is_binary(path):
+        return read_binary(path)
+    return as_visit_graph(nx.read_gml(path))
+
+
+def write_graph(G, path):
+    '''Write G to path, in the format is_binary picks for it.'''
+    if is_binary(path):
+        write_binary(G, path)
+    else:
+        nx.write_gml(G.to_networkx() if isinstance(G, VisitGraph) else G, path)
+
+
+def parse_args(argv=None):
+    argparser = argparse.ArgumentParser(description='Convert person-location graphs between GML and the binary format.')
+    argparser.add_argument('source', help='the graph to read')
+    argparser.add_argument('target', help=f'where to write it (binary if a directory or ending in {extension}, else GML)')
+    return argparser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    write_graph(read_graph(args.source), args.target)
@@ -1,7 +1,13 @@
-import networkx as nx
-import random
-import time
+import heapq
+import json
+import os
+import shutil
+from array import array
+import numpy as np
 from tqdm import tqdm
+from visit_graph import activity_types, as_visit_graph
+from util.files import temporary_dir, replace_dir
+from util.processes import fork_pool
 
 '''
 Responsible for converting the environment interaction graph 
@@ -17,73 +23,414 @@ distancing, remote work, or anything else.
 
 One edge indicates an urban actor is at a particular location.
 
-generate_interactions generates ALL possible interactions
+generate_interactions generates ALL possible interactions: one for
+every two visits by different people to the same location that overlap,
+from start up to (not including) end. u is the person whose visit
+started first, and the activity type is that visit's.
+
+They are kept in an Interactions table, column by column, with people
+named by their position in the table's people list, so that an
+interaction takes 13 bytes however long its overlap.
+
+For populations whose table does not fit in memory,
+generate_interaction_shards writes it to disk as it is produced, in
+shards of a fixed number of rows (see ShardedInteractions). The array
+simulators then go through the shards one at a time every day (see
+InteractionChunks), so their working memory follows the shard size
+rather than the number of interactions.
 
 '''
-def calculate_overlap(times1, times2):
-  range1 = range(times1[0], times1[1])
-  range2 = range(times2[0], times2[1])
-  xs = set(range1)
-  overlap = xs.intersection(range2)
-  return list(overlap)
-
-def convert_times(edgedata):
-  starttime = edgedata['starttime']
-  duration = edgedata['endtime'] - starttime
+def convert_times(G, k):
+  ''' Start and end of the visits k of the VisitGraph G, a visit past midnight ending after 2400. '''
+  start = G.start[k].astype(np.int32)
+  end = G.end[k].astype(np.int32)
   # in case of interactions at midnight
-  if duration < 0:
-    duration = duration + 2400
-  endtime = starttime + duration
-  return starttime,endtime,duration
+  return start, np.where(end < start, end + 2400, end)
+
+def location_visits(G, j):
+  '''
+  (start, end, person, code) of every visit of some length to location
+  j of the VisitGraph G, as arrays in order of start.
+  '''
+  k = G.visits_of(j)
+  start, end = convert_times(G, k)
+  k, start, end = k[end > start], start[end > start], end[end > start]
+  order = np.argsort(start, kind='stable')
+  return start[order], end[order], G.person[k[order]], G.acttype[k[order]]
+
+class Interactions:
+  '''
+  A table of interactions between people, column by column: person
+  indices u and v (int32, positions in people), the overlap from start
+  up to end (int16, HHMM times as in the graph) and the activity type
+  as an index into activity_types (uint8).
+
+  save writes one .npy file per column to a directory, and load maps
+  them back from disk without reading them into memory.
+  '''
+  columns = {'u': np.int32, 'v': np.int32, 'start': np.int16, 'end': np.int16, 'codes': np.uint8}
+
+  def __init__(self, people, u, v, start, end, codes):
+    self.people = people
+    self.u = u
+    self.v = v
+    self.start = start
+    self.end = end
+    self.codes = codes
+
+  def __len__(self):
+    return len(self.u)
+
+  @staticmethod
+  def empty(people=()):
+    ''' A table without interactions. '''
+    return Interactions(list(people), *(np.zeros(0, dtype=dtype) for dtype in Interactions.columns.values()))
+
+  def take(self, k):
+    ''' The interactions at positions k (an index array or a mask), in that order. '''
+    return Interactions(self.people, *(getattr(self, c)[k] for c in self.columns))
+
+  def save(self, path):
+    tmp = temporary_dir(path)
+    _save_people(tmp, self.people)
+    _save_columns(tmp, [getattr(self, c) for c in self.columns])
+    replace_dir(tmp, path)
+
+  @staticmethod
+  def load(path, mmap_mode='r'):
+    people = np.load(os.path.join(path, 'people.npy')).tolist()
+    return Interactions(people, *_load_columns(path, mmap_mode))
+
+def _save_people(path, people):
+  np.save(os.path.join(path, 'people.npy'), np.array([str(p) for p in people]))
+
+def _save_columns(path, columns):
+  os.makedirs(path, exist_ok=True)
+  for (c, dtype), column in zip(Interactions.columns.items(), columns):
+    np.save(os.path.join(path, c + '.npy'), np.asarray(column, dtype=dtype))
+
+def _load_columns(path, mmap_mode='r'):
+  return [np.load(os.path.join(path, c + '.npy'), mmap_mode=mmap_mode) for c in Interactions.columns]
+
+# working memory a day of simulation takes per row of a shard: the 13 bytes
+# of the row, a uniform draw and a probability for its sample, and the
+# contacts and kernel work of the rows sampled
+row_bytes = 64
+
+def shard_rows(memory):
+  ''' Rows per shard for the simulators to work within memory bytes a day. '''
+  return max(1, memory // row_bytes)
+
+class ShardWriter:
+  '''
+  Typed buffers for the interaction columns (u, v, start, end, codes) that
+  spill to disk: every time they hold rows rows, those are saved as the
+  next shard, a directory named prefix followed by its number.
+  '''
+
+  def __init__(self, directory, rows, prefix='shard-'):
+    self.directory = directory
+    self.rows = rows
+    self.prefix = prefix
+    self.buffers = [array(t) for t in 'iihhB']
+    self.shards = []
+    self.written = 0
+
+  def spill(self):
+    while len(self.buffers[0]) >= self.rows:
+      self._write(self.rows)
+
+  def close(self):
+    ''' Write whatever is left, and return the shards written as (name, rows) pairs. '''
+    if len(self.buffers[0]):
+      self._write(len(self.buffers[0]))
+    return self.shards
+
+  def _write(self, rows):
+    name = f'{self.prefix}{len(self.shards):05d}'
+    _save_columns(os.path.join(self.directory, name), [_column(b)[:rows] for b in self.buffers])
+    for b in self.buffers:
+      del b[:rows]
+    self.shards.append((name, rows))
+    self.written += rows
+
+class ShardedInteractions:
+  '''
+  An interaction table kept on disk in shards, each an Interactions table
+  of its own of at most shard_rows rows, which together hold the rows in
+  the same order as the table generate_interactions makes.
+
+  The table is a directory holding people.npy, shards.json (the shards in
+  order along with their number of rows) and one directory of columns per
+  shard. tables() maps the shards back from disk one at a time.
+  '''
+
+  def __init__(self, path):
+    self.path = path
+    with open(os.path.join(path, 'shards.json')) as f:
+      manifest = json.load(f)
+    self.shard_rows = manifest['shard_rows']
+    self.shards = [tuple(shard) for shard in manifest['shards']]
+    self.people = np.load(os.path.join(path, 'people.npy')).tolist()
+
+  def __len__(self):
+    return sum(rows for _, rows in self.shards)
+
+  def tables(self):
+    for name, _ in self.shards:
+      yield Interactions(self.people, *_load_columns(os.path.join(self.path, name)))
+
+  def save(self, path):
+    tmp = temporary_dir(path)
+    shutil.rmtree(tmp)
+    shutil.copytree(self.path, tmp)
+    replace_dir(tmp, path)
+
+  @staticmethod
+  def write(path, people, shard_rows, shards):
+    ''' Finish a table whose shards (as ShardWriter.close returns them) are already in path. '''
+    _save_people(path, people)
+    with open(os.path.join(path, 'shards.json'), 'w') as f:
+      json.dump({'shard_rows': shard_rows, 'shards': shards}, f)
+    return ShardedInteractions(path)
+
+def load_interactions(path):
+  ''' The table saved at path, by either Interactions.save or ShardedInteractions.save. '''
+  if os.path.exists(os.path.join(path, 'shards.json')):
+    return ShardedInteractions(path)
+  return Interactions.load(path)
+
+def _column(buffer):
+  ''' A typed array.array buffer as a NumPy array, without a copy. '''
+  if len(buffer) == 0:
+    return np.zeros(0, dtype=buffer.typecode)
+  return np.frombuffer(buffer, dtype=buffer.typecode)
+
+def _sweep(G, locations, progress=None, writer=None):
+  '''
+  The interaction columns (u, v, start, end, codes) of the visits to each
+  of locations (positions in the locations of the VisitGraph G), location
+  by location, and how many belong to each. With a ShardWriter, the rows
+  go to its shards as they are produced instead, and the columns come
+  back empty.
+  '''
+  # typed buffers hold each value in its final width while the table grows
+  u, v, start, end, code = writer.buffers if writer else (array(t) for t in 'iihhB')
+  produced = lambda: len(u) + (writer.written if writer else 0)
+  counts = np.zeros(len(locations), dtype=np.int64)
+  # a sweep over each location's visits in order of start: the visits
+  # still going when one starts are exactly those it overlaps
+  for j, loc in enumerate(progress(locations) if progress else locations):
+    before = produced()
+    ongoing = []
+    visits = zip(*(column.tolist() for column in location_visits(G, loc)))
+    for i, (begin, finish, p, visit_code) in enumerate(visits):
+      while ongoing and ongoing[0][0] <= begin:
+        heapq.heappop(ongoing)
+      for other_finish, _, other, other_code in ongoing:
+        if other != p:
+          u.append(other)
+          v.append(p)
+          start.append(begin)
+          end.append(min(finish, other_finish))
+          code.append(other_code)
+      heapq.heappush(ongoing, (finish, i, p, visit_code))
+      if writer:
+        writer.spill()
+    counts[j] = produced() - before
+  if writer:
+    writer.close()
+  return [_column(column) for column in (u, v, start, end, code)], counts
+
+def partition_locations(G, locations, chunks):
+  '''
+  Positions in locations split into up to chunks lists of about equal
+  work, the work of a location being its number of visits squared. Each
+  list is in increasing order.
+  '''
+  work = (G.degrees()[locations].astype(np.float64) ** 2).tolist()
+  # largest first, each onto the chunk with the least work so far
+  heap = [(0, c) for c in range(chunks)]
+  parts = [[] for _ in range(chunks)]
+  for j in sorted(range(len(locations)), key=lambda j: -work[j]):
+    load, c = heapq.heappop(heap)
+    parts[c].append(j)
+    heapq.heappush(heap, (load + work[j], c))
+  return [sorted(part) for part in parts if part]
+
+def contiguous_locations(G, locations, chunks):
+  '''
+  locations split into up to chunks runs of consecutive locations of
+  about equal work (as in partition_locations), as (start, stop) pairs.
+  '''
+  work = np.cumsum(G.degrees()[locations].astype(np.float64) ** 2)
+  bounds = np.searchsorted(work, work[-1] * np.arange(1, chunks) / chunks, side='right')
+  bounds = np.unique(np.concatenate([[0], bounds, [len(locations)]]))
+  return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+_worker = {}
+
+def _init_worker(G):
+  _worker.update(G=G)
+
+def _sweep_chunk(positions):
+  return _sweep(_worker['G'], positions)
+
+def _sweep_shards(task):
+  c, (first, last), directory, rows = task
+  writer = ShardWriter(directory, rows, f'chunk-{c:04d}-shard-')
+  _sweep(_worker['G'], range(first, last), writer=writer)
+  return writer.shards
 
 '''
-Where G is an generated graph from epidemic.generate_graph
+Where G is an generated graph from epidemic.generate_graph (a VisitGraph,
+or a NetworkX graph of the same shape, which is converted first)
+
+With workers > 1 the locations are split into chunks of about equal
+work (see partition_locations) that a pool of worker processes sweeps,
+and the pieces are put back in the order the serial sweep produces.
 '''
-def generate_interactions(G):
-  loc_cache = {}
-  interactions = []
-  for person1 in tqdm(G.nodes()):
-    if (str(person1).startswith('P_')):
-      locations = [n for n in G.neighbors(person1)]
-      for loc in locations:
-        edge = G[person1][loc][0]
-        p_data = convert_times(edge)
-        if loc not in loc_cache:
-          loc_cache[loc] = [n for n in G.neighbors(loc)]
-        for person2 in loc_cache[loc]:
-          if person2 is not person1:
-            p2_data = convert_times(G[person2][loc][0])
-            overlap = calculate_overlap(p_data, p2_data)
-            if len(overlap) > 0:
-              # we have a possible interaction!
-              interactions.append((person1, person2, overlap, edge['acttype']))
-  return interactions
+def generate_interactions(G, workers=1):
+  G = as_visit_graph(G)
+  people = G.people
+  locations = range(len(G.locations))
+  if workers <= 1 or not locations:
+    columns, _ = _sweep(G, locations, tqdm)
+    return Interactions(people, *columns)
 
-def sample_interactions(sim, interactions, percent, distancing_protocol):
-  start_time = time.time()
-  # we randomly sample a number of interactions
-  # after those are sampled, we choose times 
-  # that each interaction will occur based on the overlap.
-  def choose_overlap(element):
-    return (element[0], element[1], random.choice(element[2]), element[3])
+  parts = partition_locations(G, locations, workers * 4)
+  with _pool(G, workers) as pool:
+    results = list(tqdm(pool.map(_sweep_chunk, parts), total=len(parts)))
 
-  states = nx.get_node_attributes(sim.G, 'state')
-  sample = []
-  for i in range(len(interactions)):
-    n = interactions[i]
-    if random.random() < percent:
-      if distancing_protocol['enable_after_confirmed']:
-        if sim.confirmed > 0:
-          if distancing_protocol[n[3]] > random.random():
-            sample.append(n)
-        else:
-          sample.append(n)
-      elif distancing_protocol[n[3]] > random.random():
-        sample.append(n)
-      
+  # every location's rows, chunk after chunk, reordered by location
+  positions = np.concatenate([np.array(part, dtype=np.int64) for part in parts])
+  counts = np.concatenate([counts for _, counts in results])
+  offsets = np.cumsum(counts) - counts
+  order = np.argsort(positions, kind='stable')
+  lengths = counts[order]
+  first = np.repeat(offsets[order] - (np.cumsum(lengths) - lengths), lengths)
+  rows = np.arange(lengths.sum()) + first
+  columns = [np.concatenate([result[0][c] for result in results])[rows] for c in range(len(Interactions.columns))]
+  return Interactions(people, *columns)
 
-  return sorted(list(map(choose_overlap, sample)), key=lambda el: el[2])
+def _pool(G, workers):
+  return fork_pool(workers, _init_worker, (G,))
 
+'''
+generate_interactions, written to the directory path as a
+ShardedInteractions table with shards of shard_rows rows, never holding
+more than one shard per process in memory.
+
+With workers > 1 the locations are split into runs of consecutive
+locations of about equal work, each swept into shards of its own by a
+worker process, so the rows are in the same order as the serial sweep's,
+only cut into shards at different places.
+'''
+def generate_interaction_shards(G, path, shard_rows, workers=1):
+  G = as_visit_graph(G)
+  people = G.people
+  locations = range(len(G.locations))
+  tmp = temporary_dir(path)
+  if workers <= 1 or not locations:
+    writer = ShardWriter(tmp, shard_rows)
+    _sweep(G, locations, tqdm, writer)
+    shards = writer.shards
+  else:
+    tasks = [(c, run, tmp, shard_rows) for c, run in enumerate(contiguous_locations(G, locations, workers * 4))]
+    with _pool(G, workers) as pool:
+      shards = [shard for part in tqdm(pool.map(_sweep_shards, tasks), total=len(tasks)) for shard in part]
+  ShardedInteractions.write(tmp, people, shard_rows, shards)
+  replace_dir(tmp, path)
+  return ShardedInteractions(path)
+
+def graph_visits(G, index):
+  '''
+  Every visit in G as arrays: the visitor (through index, which maps node
+  ids to dense ids), a dense location id, its start and end in minutes
+  after midnight (a visit past midnight ends after 1440) and its activity
+  code.
+  '''
+  G = as_visit_graph(G)
+  # location by location, each one's in order of start, as location_visits lists them
+  k = G.location_visits
+  begin, finish = convert_times(G, k)
+  k, begin, finish = k[finish > begin], begin[finish > begin], finish[finish > begin]
+  k = k[np.lexsort((begin, G.location[k]))]
+  begin, finish = convert_times(G, k)
+  ids = people_ids(G.people, index)
+  person = G.person[k] if ids is None else ids[G.person[k]]
+  return (person.astype(np.int32), G.location[k], (begin // 100 * 60 + begin % 100).astype(np.int16),
+          (finish // 100 * 60 + finish % 100).astype(np.int16), G.acttype[k])
+
+def activity_probabilities(distancing_protocol):
+  ''' Chance that an activity of each type still happens under distancing_protocol. '''
+  return np.array([distancing_protocol[t] for t in activity_types], dtype=np.float64)
+
+def people_ids(people, index):
+  '''
+  The dense ids index gives people, or None when they are just their
+  positions in people.
+  '''
+  ids = np.fromiter((index[p] for p in people), dtype=np.int64, count=len(people))
+  if np.array_equal(ids, np.arange(len(ids))):
+    return None
+  return ids
+
+def index_interactions(interactions, index, ids=False):
+  '''
+  The person indices u and v of interactions, renumbered by index, which
+  maps node ids to the dense ids of a simulation. ids, when not False, is
+  people_ids(interactions.people, index), worked out beforehand.
+  '''
+  if ids is False:
+    ids = people_ids(interactions.people, index)
+  if ids is None:
+    # the usual case, people in the same order: no copies, so a mapped table stays on disk
+    return interactions.u, interactions.v
+  return ids[interactions.u], ids[interactions.v]
 
+class InteractionChunks:
+  '''
+  The potential interactions of an Interactions or ShardedInteractions
+  table as (u, v, codes) chunks of arrays, renumbered by ids (as returned
+  by people_ids): a single chunk for an Interactions table, or one per
+  shard, mapped from disk only when iteration reaches it. Can be iterated
+  over any number of times.
+  '''
 
+  def __init__(self, interactions, ids):
+    self.interactions = interactions
+    self.ids = ids
+
+  def __len__(self):
+    if isinstance(self.interactions, ShardedInteractions):
+      return len(self.interactions.shards)
+    return 1
+
+  def __iter__(self):
+    if isinstance(self.interactions, ShardedInteractions):
+      tables = self.interactions.tables()
+    else:
+      tables = [self.interactions]
+    for table in tables:
+      yield (*index_interactions(table, None, self.ids), table.codes)
+
+def sample_interactions(sim, interactions, percent, distancing_protocol):
+  # we randomly sample a number of interactions
+  # after those are sampled, we choose times 
+  # that each interaction will occur based on the overlap.
+  # all draws come from the simulation's current random stream, in one
+  # batch: a row of uniforms for the sample and a row for the times.
+  # the sample is a table whose overlaps are the minute each one happens
+  keep, when = sim.rng.random((2, len(interactions)))
+  p = percent
+  if not distancing_protocol['enable_after_confirmed'] or sim.confirmed > 0:
+    p = percent * activity_probabilities(distancing_protocol)[interactions.codes]
+  k = np.flatnonzero(keep < p)
 
+  start = interactions.start[k]
+  time = (start + (when[k] * (interactions.end[k] - start))).astype(np.int16)
+  # a stable sort of 16-bit integers is a radix (counting) sort in numpy
+  order = np.argsort(time, kind='stable')
+  k, time = k[order], time[order]
+  return Interactions(interactions.people, interactions.u[k], interactions.v[k], time, time + 1, interactions.codes[k])
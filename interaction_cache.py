@@ -0,0 +1,150 @@
+import atexit
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+from interaction import generate_interactions, generate_interaction_shards, shard_rows, load_interactions
+from profiling import profiler
+
+'''
+    A cache of potential-interaction tables on disk, keyed by the content of
+    the graph file they were generated from.
+
+    generate_interactions depends on nothing but the graph, so the table
+    for a graph file is saved (see interaction.Interactions.save) under the
+    SHA-256 of the file (or directory) and mapped back from disk by every later run on the
+    same file. Editing the graph changes its hash, so a stale table is
+    never used; VERSION goes into the key too, and is bumped whenever
+    generate_interactions changes what it produces.
+
+    By default the cache lives next to the graph, in interaction_cache/.
+    Every use of an entry marks it as recently used, and after adding one
+    the least recently used entries are removed until the cache fits in
+    max_bytes (the new entry is always kept, even if it alone is larger).
+
+    Tables too large for memory are generated straight to disk in shards
+    (see interaction.ShardedInteractions) and cached that way, under a key
+    that also holds the number of rows per shard.
+'''
+
+VERSION = 1
+
+default_max_bytes = 4 * 2**30
+
+
+def graph_digest(path, chunk_size=2**20):
+    '''
+    SHA-256 of the file at path, as hex. For a directory (a binary graph,
+    see graph_io.py), of the names and contents of its files, in order of name.
+    '''
+    digest = hashlib.sha256()
+    files = [path]
+    if os.path.isdir(path):
+        files = [os.path.join(path, name) for name in sorted(os.listdir(path))]
+    for file in files:
+        if file != path:
+            digest.update(os.path.basename(file).encode() + b'\0')
+        with open(file, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def default_cache_dir(graph_path):
+    return os.path.join(os.path.dirname(os.path.abspath(graph_path)), 'interaction_cache')
+
+
+def _size(entry):
+    # sharded entries keep their columns in a subdirectory per shard
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, files in os.walk(entry) for name in files)
+
+
+def evict(cache_dir, max_bytes, keep=None):
+    '''Remove the least recently used entries of cache_dir, other than keep, until it fits in max_bytes.'''
+    entries = [e.path for e in os.scandir(cache_dir) if e.is_dir() and not e.name.endswith('.tmp')]
+    entries.sort(key=lambda e: os.stat(e).st_mtime)
+    sizes = {e: _size(e) for e in entries}
+    total = sum(sizes.values())
+    for entry in entries:
+        if total <= max_bytes:
+            break
+        if entry == keep:
+            continue
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= sizes[entry]
+
+
+def cached_interactions(G, graph_path, cache_dir=None, max_bytes=default_max_bytes, workers=1, rows=None):
+    '''
+    The potential interactions of G, which was read from (or written to)
+    graph_path: mapped from the cache when there, else generated (by
+    workers processes) and added. With rows, they are kept in shards of
+    that many rows.
+    '''
+    if cache_dir is None:
+        cache_dir = default_cache_dir(graph_path)
+    entry = os.path.join(cache_dir, f'{graph_digest(graph_path)}-v{VERSION}' + (f'-s{rows}' if rows else ''))
+    if os.path.isdir(entry):
+        with profiler.phase('load_interactions'):
+            interactions = load_interactions(entry)
+        now = time.time()
+        os.utime(entry, (now, now))
+        print(f'Loaded {len(interactions)} potential interactions from {entry}')
+        return interactions
+
+    os.makedirs(cache_dir, exist_ok=True)
+    with profiler.phase('generate_interactions'):
+        if rows:
+            interactions = generate_interaction_shards(G, entry, rows, workers)
+        else:
+            interactions = generate_interactions(G, workers)
+            interactions.save(entry)
+    evict(cache_dir, max_bytes, keep=entry)
+    return interactions
+
+
+def add_arguments(argparser):
+    '''The command line flags for the cache, as used by from_args.'''
+    argparser.add_argument('--interaction-cache', dest='interaction_cache',
+        help='directory of cached potential interactions (default: interaction_cache/ next to the graph)')
+    argparser.add_argument('--interaction-cache-size', dest='interaction_cache_size', type=int,
+        default=default_max_bytes // 2**20, help='size cap of the interaction cache in MB')
+    argparser.add_argument('--no-interaction-cache', dest='use_interaction_cache', action='store_false', default=True,
+        help='always generate the potential interactions, and do not cache them')
+    argparser.add_argument('--interaction-memory', dest='interaction_memory', type=int,
+        help='keep the potential interactions on disk in shards, and simulate with about this many MB ' +
+             'of working memory for them (per replicate of a batch)')
+
+
+def check_arguments(argparser, args):
+    '''
+    Reject --interaction-memory with the simulations that need the
+    potential interactions in memory, before any shard gets written.
+    '''
+    if not args.interaction_memory:
+        return
+    if getattr(args, 'engine', None) == 'graph':
+        argparser.error('--interaction-memory needs --engine array, the graph engine keeps the interactions in memory')
+    if getattr(args, 'transmission', None) == 'infectious':
+        argparser.error('--interaction-memory cannot be used with --transmission infectious, which indexes the interactions in memory')
+
+
+def from_args(G, graph_path, args):
+    '''
+    The potential interactions of G as the flags from add_arguments ask,
+    generated by as many processes as args.workers, when there is such a flag.
+    Without a graph_path they are not cached.
+    '''
+    workers = getattr(args, 'workers', 1)
+    rows = shard_rows(args.interaction_memory * 2**20) if args.interaction_memory else None
+    if args.use_interaction_cache and graph_path:
+        return cached_interactions(
+            G, graph_path, args.interaction_cache, args.interaction_cache_size * 2**20, workers, rows)
+    with profiler.phase('generate_interactions'):
+        if not rows:
+            return generate_interactions(G, workers)
+        # the shards still go to disk, just not to stay there
+        directory = tempfile.mkdtemp(prefix='interactions-')
+        atexit.register(shutil.rmtree, directory, ignore_errors=True)
+        return generate_interaction_shards(G, os.path.join(directory, 'table'), rows, workers)
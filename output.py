@@ -0,0 +1,204 @@
+import csv
+import json
+import os
+
+'''
+    Per-day records of a simulation, streamed to sinks.
+
+    Every day EpidemicSim hands each of its sinks a record: the day (0 is
+    the state right after patient zero, as in EpidemicSim.history), the
+    number of people in every compartment at the start of that day, how
+    many people were newly exposed and newly confirmed since the previous
+    record, and the running number of confirmed cases.
+
+    File sinks buffer records and write them out in blocks, so a long run
+    costs one write per buffer_size days rather than one per day.
+    ConsoleSink prints the familiar per-day line, as often as asked.
+
+    A run resumed from a checkpoint (see checkpoint.py) continues the file
+    of the run it resumes: a file sink opened with resume=day keeps the
+    records already written for the days before day, drops any for later
+    days (written after the checkpoint was saved) and appends from there.
+'''
+
+FIELDS = ['day', 'S', 'E', 'I', 'Q', 'R', 'D', 'new_exposed', 'new_confirmed', 'confirmed']
+
+
+class Sink:
+    def write(self, record):
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class BufferedSink(Sink):
+    '''A sink that hands records to _flush buffer_size at a time.'''
+
+    def __init__(self, path, buffer_size=256):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.rows = []
+
+    def write(self, record):
+        self.rows.append(record)
+        if len(self.rows) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            self._flush(self.rows)
+            self.rows = []
+
+    def _flush(self, rows):
+        raise NotImplementedError
+
+
+def _cut(path, day, header, parse):
+    '''
+    Truncate path, a file of header lines then one record per line, at its
+    first record of day or later (or cut short by a crash). Returns whether
+    anything is left of it.
+    '''
+    if not os.path.exists(path):
+        return False
+    offset = 0
+    with open(path, 'rb') as f:
+        for i, line in enumerate(f):
+            if i >= header and (not line.endswith(b'\n') or parse(line) >= day):
+                break
+            offset += len(line)
+    os.truncate(path, offset)
+    return offset > 0
+
+
+class CSVSink(BufferedSink):
+    def __init__(self, path, buffer_size=256, resume=None):
+        super().__init__(path, buffer_size)
+        append = resume is not None and _cut(path, resume, 1, lambda line: int(line.split(b',')[0]))
+        self.file = open(path, 'a' if append else 'w', newline='')
+        self.writer = csv.DictWriter(self.file, fieldnames=FIELDS)
+        if not append:
+            self.writer.writeheader()
+
+    def _flush(self, rows):
+        self.writer.writerows(rows)
+        self.file.flush()
+
+    def close(self):
+        super().close()
+        self.file.close()
+
+
+class NDJSONSink(BufferedSink):
+    '''One JSON object per line.'''
+
+    def __init__(self, path, buffer_size=256, resume=None):
+        super().__init__(path, buffer_size)
+        append = resume is not None and _cut(path, resume, 0, lambda line: json.loads(line)['day'])
+        self.file = open(path, 'a' if append else 'w')
+
+    def _flush(self, rows):
+        self.file.write(''.join(json.dumps(row) + '\n' for row in rows))
+        self.file.flush()
+
+    def close(self):
+        super().close()
+        self.file.close()
+
+
+class ParquetSink(BufferedSink):
+    '''
+    One Parquet row group per buffer. Needs pyarrow. A Parquet file cannot
+    be appended to, so resuming rewrites the records it keeps.
+    '''
+
+    def __init__(self, path, buffer_size=256, resume=None):
+        super().__init__(path, buffer_size)
+        try:
+            import pyarrow
+            import pyarrow.compute
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError('writing Parquet output needs pyarrow (pip install pyarrow)')
+        self.pa = pyarrow
+        self.schema = pyarrow.schema([(field, pyarrow.int64()) for field in FIELDS])
+        kept = None
+        if resume is not None and os.path.exists(path):
+            kept = pyarrow.parquet.read_table(path)
+            kept = kept.filter(pyarrow.compute.less(kept['day'], resume))
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+        if kept is not None and kept.num_rows:
+            self.writer.write_table(kept)
+
+    def _flush(self, rows):
+        columns = {field: [row[field] for row in rows] for field in FIELDS}
+        self.writer.write_table(self.pa.Table.from_pydict(columns, schema=self.schema))
+
+    def close(self):
+        super().close()
+        self.writer.close()
+
+
+class ConsoleSink(Sink):
+    '''Prints every every-th day, and the last day written when flushed.'''
+
+    def __init__(self, every=1):
+        self.every = every
+        self.last = None
+
+    def write(self, record):
+        self.last = record
+        if record['day'] % self.every == 0:
+            self._print(record)
+            self.last = None
+
+    def _print(self, c):
+        print(f"Day {c['day'] + 1}\t" +
+              f"S: {c['S']}" +
+              f"\tE: {c['E']}" +
+              f"\tI: {c['I']}" +
+              f"\tQ: {c['Q']}" +
+              f"\tR: {c['R']}" +
+              f"\tD: {c['D']}")
+
+    def flush(self):
+        if self.last is not None:
+            self._print(self.last)
+            self.last = None
+
+
+formats = {
+    'csv': CSVSink,
+    'ndjson': NDJSONSink,
+    'parquet': ParquetSink,
+}
+
+extensions = {
+    '.csv': 'csv',
+    '.ndjson': 'ndjson',
+    '.jsonl': 'ndjson',
+    '.json': 'ndjson',
+    '.parquet': 'parquet',
+}
+
+
+def open_sink(path, format=None, buffer_size=256, resume=None):
+    '''
+    A file sink for path, in format or else the one its extension suggests,
+    continuing it from day resume if given.
+    '''
+    if format is None:
+        format = extensions.get(os.path.splitext(path)[1].lower())
+        if format is None:
+            raise ValueError(f'cannot tell the output format of {path}, pass one of {", ".join(formats)}')
+    return formats[format](path, buffer_size, resume)
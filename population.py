@@ -1,9 +1,10 @@
 from util.webapi import get_json, parse_query
+from providers import get_provider
 from tqdm import tqdm
 import numpy as np
 from scipy.stats import norm
 import itertools
-import random
+from sampling import AliasTable, GroupedPool
 
 '''
     Responsible for creating the population that the urban actor
@@ -120,7 +121,7 @@ def import_person_data():
     # PINCP - personal income
     # PUMA  - (ignore) region of no less than 10,000 people
     # ST    - State
-    res = get_person_json(def_region)
+    res = get_provider().person_rows()
 
     headers = res[0]
     data = res[1:]
@@ -129,7 +130,7 @@ def import_person_data():
 
 
 def import_household_data():
-    res = get_household_json(def_region)
+    res = get_provider().household_rows()
     data = list(filter(lambda x: int(x[1]) is not 0, res[1:]))
     headers = res[0]
     weight = np.array(data)[:, 0].astype(int)
@@ -137,11 +138,13 @@ def import_household_data():
     return data, weight
 
 
-def generate(n):
+def generate(n, rng=None):
+    if rng is None:
+        rng = np.random.default_rng()
     print("\n-- GENERATE POPULATION --")
     print("Sampling a population of size " + str(n) + "...")
     data, weights = import_person_data()
-    samples = random.choices(data, k=n, weights=weights)
+    samples = [data[i] for i in AliasTable(weights).draw(rng, n)]
     population = list(map(lambda p: Person(p[1], p[3], p[2]), samples))
 
     # print("Sample People: \n")
@@ -156,89 +159,64 @@ def generate(n):
     adult_sample_households = list(filter(lambda hh: int(hh[1]) >= 18, sample_households))
     selectors = [int(hh[1]) >= 18 for hh in sample_households]
     adult_hh_weights = list(itertools.compress(hh_weights, selectors))
+    hh_table = AliasTable(adult_hh_weights)
 
     rv = norm(scale=3)  # normal distribution
 
-    # weight children more heavily when selecting the rest of a household
-    wide_norm = norm(scale=30)
-    ch_weights = []
-    for i in range(0, 100):
-        ch_weights.append(rv.pdf(i - 10))
+    # people are drawn by age, so the pool weighs everyone of an age alike
+    ages = np.arange(100)
+    pool = GroupedPool([p.getAge() for p in population], len(ages))
 
-    def weightChildren(x): return ch_weights[x]
-    chWeights = [weightChildren(p.getAge()) for p in population]
+    # weight children more heavily when selecting the rest of a household
+    ch_weights = rv.pdf(ages - 10)
 
-    adult_population = list(filter(lambda p: p.getAge() >= 24, population))
+    # head_weights[i] favors adults closest to age i; pdf is slow, so we precalculate results
+    print("Generating probability distributions...")
+    head_weights = np.where(ages >= 24, rv.pdf(ages[None, :] - ages[:, None]), 0)
 
-    # pdf is slow, so we precalculate results
-    pdf_vals = []
-    for i in range(-100, 100):
-        pdf_vals.append(rv.pdf(i))
+    def adults_left():
+        return pool.counts[24:].sum() > 0
 
-    print("Generating probability distributions...")
-    rv_weights = []
-    for i in tqdm(range(0, 100)):
-        w = []
-        for p in adult_population:
-            w.append(pdf_vals[p.getAge() - i])
-        rv_weights.append(w)
-
-    def removePerson(p):
-        if (p.getAge() >= 24):
-            a_ind = adult_population.index(p)
-            for w in rv_weights:
-                w.pop(a_ind)
-            adult_population.remove(p)
-        p_ind = population.index(p)
-        chWeights.pop(p_ind)
-        population.remove(p)
+    def take(key, weights):
+        i = pool.draw(rng, key, weights)
+        pool.remove(i)
+        return population[i]
 
     print("Generating selection of households...")
-    t = len(population)
+    t = len(pool)
     with tqdm(total=t) as pbar:
-        while len(population) > 0:
-            before=len(population)
+        while len(pool) > 0:
+            before=len(pool)
             # we take the list of people and select households
             # first, grab a household that we will select upon (filtered by adult presence)
-            hh_sample = random.choices(
-                adult_sample_households,
-                k=1,
-                weights=adult_hh_weights)[0]
+            hh_sample = adult_sample_households[hh_table.draw(rng)]
             hh = Household()
 
-            if len(adult_population) > 0:
+            if adults_left():
                 # -- PICK HEAD OF HOUSEHOLD --
                 # head age of this household (with reference to the sample data)
                 preferred_head_age = int(hh_sample[1])
                 # get population weights and grab a sample that is closest to the selected age
-                hh_head = random.choices(
-                    adult_population,
-                    k=1,
-                    weights=rv_weights[preferred_head_age])[0]
-                removePerson(hh_head)
+                hh_head = take(('head', preferred_head_age), head_weights[preferred_head_age])
                 hh.addHead(hh_head)
 
                 # -- SELECT THE REMAINDER OF THE HOUSEHOLD BY SIZE --
                 hht = hh_sample[2]
                 if hht != 4 and hht != 6:
-                    if len(population) > 0:
-                        if hht == 1:
+                    if len(pool) > 0:
+                        if hht == 1 and adults_left():
                             # fetch spouse
-                            spouse = random.choices(
-                                adult_population, k=1, weights=rv_weights[preferred_head_age])[0]
-                            removePerson(spouse)
+                            spouse = take(('head', preferred_head_age), head_weights[preferred_head_age])
                             hh.addSpouse(spouse)
                         for i in range(int(hh_sample[2]) - hh.getSize()):
-                            if len(population) > 0:
-                                p = random.choices(population, k=1, weights=chWeights)[0]
-                                removePerson(p)
-                                hh.addPerson(p)
+                            if len(pool) > 0:
+                                hh.addPerson(take('child', ch_weights))
                 households.append(hh)
             else:
-                if len(population) > 0:
-                    print("Didn't include " + str(len(population)) + " people")
+                if len(pool) > 0:
+                    print("Didn't include " + str(len(pool)) + " people")
                 break
-            pbar.update(before-len(population))
+            pbar.update(before-len(pool))
     print("Generated " + str(len(households)) + " households.\n")
     # print("Sample Households: \n")
     # for i in range(3):
@@ -0,0 +1,135 @@
+import cProfile
+import json
+import time
+from collections import defaultdict
+
+'''
+    Timing instrumentation for the pipeline and the day loop.
+
+    Code marks a stage with
+
+        with profiler.phase('generate_interactions'):
+            ...
+
+    While the profiler is disabled (the default), phase returns a shared
+    do-nothing context, so the marks cost next to nothing. Once enabled it
+    keeps, per stage, the number of calls, the total time, and the time
+    spent on each simulated day (the day being profiler.day, which the
+    simulators keep up to date). Stages nest: the time of an inner stage is
+    also counted in the outer one.
+
+    Only the calling process is measured; replicates and sweep points run
+    in worker processes do not report back.
+'''
+
+
+class _Null:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_null = _Null()
+
+
+class _Phase:
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.add(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class Stage:
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.by_day = defaultdict(float)
+
+
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.day = None
+        self.stages = {}
+        self.started = None
+        self.cprofile = None
+
+    def enable(self, cprofile=False):
+        '''Start measuring, under cProfile as well if asked.'''
+        self.enabled = True
+        self.started = time.perf_counter()
+        if cprofile:
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+
+    def phase(self, name):
+        if not self.enabled:
+            return _null
+        return _Phase(self, name)
+
+    def add(self, name, elapsed):
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = Stage()
+        stage.calls += 1
+        stage.total += elapsed
+        if self.day is not None:
+            stage.by_day[self.day] += elapsed
+
+    def wall_time(self):
+        return time.perf_counter() - self.started
+
+    def report(self):
+        '''Everything measured so far, as a JSON-friendly dict.'''
+        return {
+            'wall_time': self.wall_time(),
+            'stages': {
+                name: {
+                    'calls': stage.calls,
+                    'total': stage.total,
+                    'mean': stage.total / stage.calls,
+                    'per_day': {str(day): t for day, t in sorted(stage.by_day.items())},
+                }
+                for name, stage in self.stages.items()
+            },
+        }
+
+    def summary(self):
+        '''A table of the stages, slowest first.'''
+        wall = self.wall_time()
+        lines = [f"{'Stage':<28}{'Calls':>10}{'Total (s)':>12}{'Mean (ms)':>12}{'Max/day (ms)':>14}{'% Wall':>8}"]
+        for name, stage in sorted(self.stages.items(), key=lambda item: -item[1].total):
+            worst = f'{max(stage.by_day.values()) * 1000:.3f}' if stage.by_day else '-'
+            lines.append(f'{name:<28}{stage.calls:>10}{stage.total:>12.3f}'
+                         f'{stage.total / stage.calls * 1000:>12.3f}{worst:>14}'
+                         f'{stage.total / wall * 100:>7.1f}%')
+        lines.append(f"{'wall time':<28}{'':>10}{wall:>12.3f}")
+        return '\n'.join(lines)
+
+    def finish(self, report_path=None, cprofile_path=None):
+        '''Stop measuring, print the summary and write whatever was asked for.'''
+        if self.cprofile is not None:
+            self.cprofile.disable()
+            if cprofile_path:
+                self.cprofile.dump_stats(cprofile_path)
+        print('\nProfile:')
+        print(self.summary())
+        if report_path:
+            with open(report_path, 'w') as f:
+                json.dump(self.report(), f, indent=2)
+        self.enabled = False
+
+
+# the profiler every module reports to
+profiler = Profiler()
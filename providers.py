@@ -0,0 +1,267 @@
+import argparse
+import json
+import os
+import numpy as np
+import pandas
+from seeding import RandomStreams, DATA
+
+'''
+    Where the pipeline gets its input data.
+
+    Building a population needs three inputs: PUMS person and household
+    rows (population.generate), NHTS trip records (actors.templates) and
+    parcel points (gis.GastonCountyGIS). A provider serves all three:
+
+        person_rows()     PUMS rows, header first: PWGTP, AGEP, SEX, PINCP
+        household_rows()  PUMS rows, header first: PWGTP, AGEP, HHT, NP
+        trips()           a DataFrame of NHTS trips with at least the trip_cols below
+        parcels()         a GeoDataFrame of parcel points with PARNO and PARUSECODE
+
+    WebProvider, the default, downloads them from the Census API, the NHTS
+    site and NC OneMap, as the pipeline always has. OfflineProvider reads
+    them from files in a directory and never touches the network. Such a
+    directory is filled once, either with what WebProvider serves
+    ('python providers.py prewarm DIR', on a machine with network access)
+    or with procedurally generated data from SyntheticProvider
+    ('python providers.py synthesize DIR'), and can then be copied to any
+    number of machines.
+
+    The pipeline asks get_provider() for its data, so set_provider (or
+    'epidemic.py --data-dir DIR') switches every stage at once.
+'''
+
+person_file = 'pums_persons.json'
+household_file = 'pums_households.json'
+trip_file = 'trips.csv'
+parcel_file = 'parcels.csv'
+
+person_header = ['PWGTP', 'AGEP', 'SEX', 'PINCP']
+household_header = ['PWGTP', 'AGEP', 'HHT', 'NP']
+trip_cols = ['HOUSEID', 'PERSONID', 'HHFAMINC', 'WHYTO', 'WHYFROM',
+             'STRTTIME', 'ENDTIME', 'TRPMILES', 'R_AGE_IMP', 'R_SEX_IMP']
+
+
+def _points(df):
+    import geopandas as gpd
+    return gpd.GeoDataFrame(
+        df[['PARNO', 'PARUSECODE']], geometry=gpd.points_from_xy(df['x'], df['y']))
+
+
+class Provider:
+    # distinguishes what this provider serves in the local cache (see util/webapi.py)
+    key = ''
+
+    def person_rows(self):
+        raise NotImplementedError
+
+    def household_rows(self):
+        raise NotImplementedError
+
+    def trips(self):
+        raise NotImplementedError
+
+    def parcels(self):
+        raise NotImplementedError
+
+    def cache_key(self, name):
+        return self.key + name
+
+
+class WebProvider(Provider):
+    '''Census, NHTS and parcel data downloaded on first use and kept under data/ and cache/.'''
+
+    trip_file = "data/nhts/trippub.csv"
+    shape_file = "data/ncgis/nc_gaston_parcels_pt.shp"
+
+    def person_rows(self):
+        from population import get_person_json, def_region
+        return get_person_json(def_region)
+
+    def household_rows(self):
+        from population import get_household_json, def_region
+        return get_household_json(def_region)
+
+    def trips(self):
+        from util.webapi import init_nhts
+        init_nhts()
+        return pandas.read_csv(self.trip_file)
+
+    def parcels(self):
+        import geopandas as gpd
+        from util.webapi import init_gis
+        init_gis()
+        return gpd.read_file(self.shape_file)
+
+
+class OfflineProvider(Provider):
+    '''Data read from the files of a directory written by save.'''
+
+    def __init__(self, directory):
+        self.directory = directory
+        missing = [f for f in (person_file, household_file, trip_file, parcel_file)
+                   if not os.path.isfile(self._path(f))]
+        if missing:
+            raise FileNotFoundError(
+                f'{directory} is missing {", ".join(missing)}; fill it with ' +
+                f'"python providers.py prewarm {directory}" or "python providers.py synthesize {directory}"')
+        # files copied in or regenerated under the same name must not hit stale cache entries
+        stamps = [(os.path.getsize(self._path(f)), os.path.getmtime(self._path(f)))
+                  for f in (person_file, household_file, trip_file, parcel_file)]
+        self.key = f'offline:{os.path.abspath(directory)}:{stamps}:'
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _json(self, name):
+        with open(self._path(name)) as f:
+            return json.load(f)
+
+    def person_rows(self):
+        return self._json(person_file)
+
+    def household_rows(self):
+        return self._json(household_file)
+
+    def trips(self):
+        return pandas.read_csv(self._path(trip_file))
+
+    def parcels(self):
+        return _points(pandas.read_csv(self._path(parcel_file), dtype={'PARNO': str, 'PARUSECODE': str}))
+
+
+class SyntheticProvider(Provider):
+    '''
+    Procedurally generated stand-ins for the real data, drawn from rng:
+    PUMS rows for people and households, NHTS-style trips of template
+    households (every person leaves home, makes one to three stops and
+    comes back) and parcels of every land use gis.py knows of.
+    '''
+
+    def __init__(self, rng=None, people=20000, households=8000, templates=3000, parcels=20000):
+        if rng is None:
+            rng = np.random.default_rng()
+        self.rng = rng
+        self.people = people
+        self.households = households
+        self.templates = templates
+        self.parcel_count = parcels
+        self.key = f'synthetic:{people}:{households}:{templates}:{parcels}:'
+
+    def person_rows(self):
+        rng = self.rng
+        n = self.people
+        ages = rng.integers(0, 95, size=n)
+        incomes = np.where(
+            ages < 15, -19999, np.round(rng.lognormal(10.3, 1.0, size=n), -2).astype(int))
+        rows = zip(rng.integers(1, 100, size=n), ages, rng.integers(1, 3, size=n), incomes)
+        return [person_header] + [[str(v) for v in row] for row in rows]
+
+    def household_rows(self):
+        rng = self.rng
+        n = self.households
+        rows = zip(rng.integers(1, 100, size=n), rng.integers(18, 95, size=n),
+                   rng.integers(1, 8, size=n), rng.integers(1, 7, size=n))
+        return [household_header] + [[str(v) for v in row] for row in rows]
+
+    def trips(self):
+        rng = self.rng
+        # WHYTO codes: school, work, shopping, services, and a few others (see actors.trip_purposes)
+        purposes = np.array([8, 3, 11, 12, 5, 6, 9, 10])
+        rows = []
+        for h in range(self.templates):
+            houseid = 30000001 + h
+            income = int(rng.integers(1, 12))
+            for pid in range(1, int(rng.integers(1, 7)) + 1):
+                age = int(rng.integers(0, 90))
+                sex = int(rng.integers(1, 3))
+                stops = [int(s) for s in rng.choice(purposes, size=int(rng.integers(1, 4)))]
+                # children go to school (or child care) rather than work, adults the other way round
+                if age < 18:
+                    stops = [(8 if age >= 5 else 9) if s in (3, 8) else s for s in stops]
+                else:
+                    stops = [3 if s == 8 else s for s in stops]
+                t = int(rng.integers(6 * 60, 9 * 60))
+                where = 1
+                for to in stops + [1]:
+                    ride = int(rng.integers(5, 40))
+                    end = min(t + ride, 23 * 60 + 59)
+                    rows.append([houseid, pid, income, to, where, t // 60 * 100 + t % 60,
+                                 end // 60 * 100 + end % 60, round(ride / 2, 1), age, sex])
+                    where = to
+                    t = min(end + int(rng.integers(30, 8 * 60 if to in (3, 8) else 120)), 23 * 60 + 30)
+        return pandas.DataFrame(rows, columns=trip_cols)
+
+    def parcels(self):
+        from gis import GastonCountyGIS as gcgis
+        rng = self.rng
+        n = self.parcel_count
+        kinds = [gcgis.homes, gcgis.workplaces, gcgis.shopping, gcgis.schools, ['5000', '6000', '9000']]
+        shares = np.array([0.7, 0.15, 0.07, 0.005, 0.075])
+        # at least one of every kind, so every activity has somewhere to go
+        kind = np.concatenate([np.arange(len(kinds)), rng.choice(len(kinds), size=n - len(kinds), p=shares)])
+        codes = [kinds[k][rng.integers(len(kinds[k]))] for k in kind]
+        # NC State Plane feet, roughly the extent of Gaston County
+        df = pandas.DataFrame({
+            'PARNO': [str(100000 + i) for i in range(n)],
+            'PARUSECODE': codes,
+            'x': rng.uniform(1.30e6, 1.40e6, size=n),
+            'y': rng.uniform(5.30e5, 6.00e5, size=n),
+        })
+        return _points(df)
+
+
+def save(provider, directory):
+    '''Write everything provider serves to directory, for an OfflineProvider to read.'''
+    os.makedirs(directory, exist_ok=True)
+    for name, rows in ((person_file, provider.person_rows()), (household_file, provider.household_rows())):
+        with open(os.path.join(directory, name), 'w') as f:
+            json.dump(rows, f)
+    provider.trips()[trip_cols].to_csv(os.path.join(directory, trip_file), index=False)
+    parcels = provider.parcels()
+    pandas.DataFrame({
+        'PARNO': parcels['PARNO'],
+        'PARUSECODE': parcels['PARUSECODE'],
+        'x': parcels.geometry.x,
+        'y': parcels.geometry.y,
+    }).to_csv(os.path.join(directory, parcel_file), index=False)
+
+
+_provider = WebProvider()
+
+
+def get_provider():
+    return _provider
+
+
+def set_provider(provider):
+    global _provider
+    _provider = provider
+
+
+def parse_args(argv=None):
+    argparser = argparse.ArgumentParser(description='Fill a directory with the input data of the pipeline.')
+    argparser.add_argument('command', choices=['prewarm', 'synthesize'],
+        help='prewarm: download the real data; synthesize: generate stand-in data')
+    argparser.add_argument('directory', help='where to write the data files')
+    argparser.add_argument('--seed', dest='seed', type=int, default=None,
+        help='seed for the synthesized data')
+    argparser.add_argument('--people', dest='people', type=int, default=20000,
+        help='number of synthesized PUMS person rows')
+    argparser.add_argument('--households', dest='households', type=int, default=8000,
+        help='number of synthesized PUMS household rows')
+    argparser.add_argument('--templates', dest='templates', type=int, default=3000,
+        help='number of synthesized NHTS households')
+    argparser.add_argument('--parcels', dest='parcels', type=int, default=20000,
+        help='number of synthesized parcels')
+    return argparser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.command == 'prewarm':
+        provider = WebProvider()
+    else:
+        provider = SyntheticProvider(
+            RandomStreams(args.seed).generator(DATA), args.people, args.households, args.templates, args.parcels)
+    save(provider, args.directory)
+    print(f'Wrote {args.directory}')
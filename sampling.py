@@ -0,0 +1,124 @@
+import numpy as np
+
+'''
+    Weighted random draws from distributions that are set up once and
+    drawn from many times.
+
+    AliasTable is a Walker alias table, built with Vose's method: after an
+    O(n) setup every draw costs O(1), whether one at a time or a batch at
+    once, where rng.choice(..., p=...) redoes an O(n) cumulative sum on
+    every call. A single uniform picks both the column (its integer part
+    after scaling by n) and the coin flip within it (its fractional part).
+
+    GroupedPool draws without replacement among items that come in groups,
+    all items of a group weighing the same (people of one age, say). It
+    keeps an alias table over the groups per weighting and corrects for the
+    items removed since by rejection, rebuilding the table once fewer than
+    half of its draws would be accepted.
+'''
+
+
+class AliasTable:
+    '''Draws from values (by default 0..n-1) with probabilities proportional to weights.'''
+
+    def __init__(self, weights, values=None):
+        weights = np.asarray(weights, dtype=np.float64)
+        n = len(weights)
+        total = weights.sum()
+        if n == 0 or not total > 0:
+            raise ValueError('an alias table needs at least one positive weight')
+        self.values = None if values is None else np.asarray(values)
+        self.n = n
+
+        scaled = (weights * (n / total)).tolist()
+        small = [i for i, w in enumerate(scaled) if w < 1]
+        large = [i for i, w in enumerate(scaled) if w >= 1]
+        # columns left over at the end are full, up to rounding
+        prob = [1.0] * n
+        alias = list(range(n))
+        while small and large:
+            s = small.pop()
+            l = large[-1]
+            prob[s] = scaled[s]
+            alias[s] = l
+            scaled[l] -= 1 - scaled[s]
+            if scaled[l] < 1:
+                small.append(large.pop())
+        # lists for single draws, which index them faster than arrays
+        self._prob = prob
+        self._alias = alias
+        self.prob = np.array(prob)
+        self.alias = np.array(alias, dtype=np.int64)
+
+    def draw(self, rng, size=None):
+        '''One value, or an array of size of them, drawn from rng.'''
+        if size is None:
+            x = rng.random() * self.n
+            # the product can round up to n itself for large n
+            i = min(int(x), self.n - 1)
+            if x - i >= self._prob[i]:
+                i = self._alias[i]
+            return i if self.values is None else self.values[i]
+        x = rng.random(size) * self.n
+        i = np.minimum(x.astype(np.int64), self.n - 1)
+        i = np.where(x - i < self.prob[i], i, self.alias[i])
+        return i if self.values is None else self.values[i]
+
+
+class GroupedPool:
+    '''
+    Items 0..n-1, item i in group groups[i] (of n_groups, by default
+    enough for the largest), that are drawn one at a time and removed. A
+    draw weighs every item remaining by the weight of its group.
+    '''
+
+    def __init__(self, groups, n_groups=None):
+        groups = np.asarray(groups, dtype=np.int64)
+        if n_groups is None:
+            n_groups = groups.max() + 1 if len(groups) else 0
+        self.members = [[] for _ in range(n_groups)]
+        self.group = groups.tolist()
+        self.position = [0] * len(groups)
+        for i, g in enumerate(self.group):
+            self.position[i] = len(self.members[g])
+            self.members[g].append(i)
+        self.counts = np.array([len(m) for m in self.members], dtype=np.float64)
+        self.size = len(groups)
+        # key -> (alias table, group counts it was built for, total weight it was built for)
+        self.tables = {}
+
+    def __len__(self):
+        return self.size
+
+    def remove(self, item):
+        g = self.group[item]
+        members = self.members[g]
+        pos = self.position[item]
+        last = members.pop()
+        if last != item:
+            members[pos] = last
+            self.position[last] = pos
+        self.counts[g] -= 1
+        self.size -= 1
+
+    def draw(self, rng, key, weights):
+        '''
+        An item drawn from rng with probability proportional to the weight
+        of its group. weights, one per group, must be the same every time
+        key is.
+        '''
+        weights = np.asarray(weights, dtype=np.float64)
+        live = float(self.counts @ weights)
+        if not live > 0:
+            raise ValueError('no remaining item has a positive weight')
+        entry = self.tables.get(key)
+        if entry is None or live < entry[2] / 2:
+            entry = (AliasTable(self.counts * weights), self.counts.copy(), live)
+            self.tables[key] = entry
+        table, built, _ = entry
+        while True:
+            g = table.draw(rng)
+            # the group had built[g] items when the table was made, keep the draw if it hit one still here
+            if rng.random() * built[g] < self.counts[g]:
+                members = self.members[g]
+                return members[int(rng.random() * len(members))]
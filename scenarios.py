@@ -0,0 +1,126 @@
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+import epidemic
+from state import E, I, Q
+from sweep import summarize_point, parse_value
+import interaction_cache
+from graph_io import read_graph
+from util.processes import fork_pool
+
+'''
+    What-if studies that branch off a shared simulation prefix.
+
+    The common first days are simulated once. EpidemicSim.fork then gives
+    each branch its own copy of the state as of the branching day, with its
+    config overrides applied, and only the remaining days are simulated per
+    branch. With several workers the branches run in forked processes,
+    which inherit the parent simulation and the potential interactions
+    copy-on-write instead of receiving pickled copies.
+
+    Branches keep the random streams of the prefix (see seeding.py), so a
+    branch without overrides continues exactly as the unbranched run would.
+'''
+
+_worker = {}
+
+
+def _init_worker(sim, potential_interactions):
+    _worker['sim'] = sim
+    _worker['potential_interactions'] = potential_interactions
+
+
+def _run_branch(overrides):
+    child = _worker['sim'].fork(overrides)
+    return child.simulate(_worker['potential_interactions'], child.days - child.day, verbose=False)
+
+
+def run_scenarios(sim, potential_interactions, branches, workers=1):
+    '''
+    Advance a fork of sim (see EpidemicSim.fork) for every override dict in
+    branches, up to its config's days. Returns the (history, finished) pair
+    of each branch, as returned by EpidemicSim.simulate.
+    '''
+    if workers > 1:
+        with fork_pool(workers, _init_worker, (sim, potential_interactions)) as pool:
+            return list(tqdm(pool.map(_run_branch, branches), total=len(branches)))
+    _init_worker(sim, potential_interactions)
+    results = [_run_branch(overrides) for overrides in tqdm(branches)]
+    _worker.clear()
+    return results
+
+
+def parse_branch(text):
+    ''''KEY=V,KEY=V' into an override dict.'''
+    overrides = {}
+    for item in text.split(','):
+        key, value = item.split('=', 1)
+        overrides[key] = parse_value(value)
+    return overrides
+
+
+def parse_args(argv=None):
+    argparser = argparse.ArgumentParser(description='Simulate a shared prefix once, then branch into what-if scenarios.')
+    argparser.add_argument('--graph-in', '-i', dest='graph_in', required=True,
+        help='a previously-generated synthetic population')
+    argparser.add_argument('--fork-day', dest='fork_day', type=int, default=30,
+        help='the day on which the scenarios branch off')
+    argparser.add_argument('--branch', dest='branches', action='append', default=[], metavar='KEY=V,KEY=V,...',
+        help='add a scenario, e.g. --branch social_distancing=true or --branch distancing.W=0.1,distancing.S=0.5')
+    argparser.add_argument('--engine', dest='engine', choices=epidemic.engines.keys(), default='array',
+        help='where per-person state is kept: NetworkX node attributes or NumPy arrays')
+    argparser.add_argument('--transmission', dest='transmission', choices=epidemic.ArrayEpidemicSim.transmissions, default='sequential',
+        help='transmission kernel')
+    argparser.add_argument('--workers', dest='workers', type=int, default=1,
+        help='number of worker processes used to generate the potential interactions and run branches')
+    argparser.add_argument('--seed', dest='seed', type=int, default=None,
+        help='seed for the prefix and every branch')
+    argparser.add_argument('--max-days', dest='maxdays', type=int, default=1000,
+        help='the max number of days for each scenario to last')
+    argparser.add_argument('--plot', '-p', dest='p', action='store_true', default=False,
+        help='use matplotlib to plot the infected curve of every scenario')
+    interaction_cache.add_arguments(argparser)
+    args = argparser.parse_args(argv)
+    interaction_cache.check_arguments(argparser, args)
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    # the unchanged scenario comes first, as a reference
+    labels = ['baseline'] + args.branches
+    branches = [{}] + [parse_branch(b) for b in args.branches]
+
+    G = read_graph(args.graph_in)
+    config = {'transmission': args.transmission, 'seed': args.seed, 'days': args.maxdays}
+    sim = epidemic.engines[args.engine](G, False, config)
+    potential_interactions = None
+    # branches may switch to a transmission that needs them
+    if any(epidemic.needs_interactions(epidemic.apply_overrides({**epidemic.default_config, **config}, branch))
+           for branch in branches):
+        potential_interactions = interaction_cache.from_args(G, args.graph_in, args)
+
+    start_time = time.time()
+    sim.start()
+    sim.simulate(potential_interactions, args.fork_day, verbose=False)
+    print(f'Simulated {sim.day} shared days in {time.time() - start_time:.2f}s')
+
+    start_time = time.time()
+    results = run_scenarios(sim, potential_interactions, branches, args.workers)
+    print(f'Ran {len(branches)} scenarios from day {sim.day + 1} in {time.time() - start_time:.2f}s')
+
+    table = pd.DataFrame([{'scenario': label, **summarize_point([history])}
+                          for label, (history, finished) in zip(labels, results)])
+    print(table.to_string(index=False))
+
+    if args.p:
+        import matplotlib.pyplot as plt
+        for label, (history, finished) in zip(labels, results):
+            plt.plot(np.arange(len(history)), history[:, E] + history[:, I] + history[:, Q], label=label)
+        plt.axvline(sim.day, color='gray', linestyle='--')
+        plt.legend()
+        plt.ylabel('Number of Infected')
+        plt.xlabel('Days')
+        plt.show()
@@ -0,0 +1,40 @@
+import numpy as np
+
+'''
+    Day-bucketed queue of upcoming disease transitions.
+
+    Instead of checking every person's timers every day, ArrayEpidemicSim
+    files each person under the days on which one of their timers comes due
+    (end of incubation, end of the infection, a test result) as soon as the
+    timer is set. Each day it only looks at the people filed under that day.
+'''
+
+
+class Scheduler:
+    '''People waiting for something to happen to them, bucketed by day.'''
+
+    def __init__(self):
+        self.buckets = {}
+
+    def push(self, days, idx):
+        '''File each person in idx under the matching entry of days (or under days, if a scalar).'''
+        days = np.broadcast_to(days, idx.shape)
+        if not len(idx):
+            return
+        order = np.argsort(days, kind='stable')
+        days, idx = days[order], idx[order]
+        bounds = np.flatnonzero(np.diff(days)) + 1
+        for day, group in zip(days[np.r_[0, bounds]].tolist(), np.split(idx, bounds)):
+            self.buckets.setdefault(day, []).append(group)
+
+    def pop(self, day):
+        '''Sorted ids of everyone filed under day, which is then emptied.'''
+        groups = self.buckets.pop(day, None)
+        if groups is None:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate(groups))
+
+    def copy(self):
+        other = Scheduler()
+        other.buckets = {day: list(groups) for day, groups in self.buckets.items()}
+        return other
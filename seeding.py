@@ -0,0 +1,56 @@
+import numpy as np
+
+'''
+    Reproducible random streams.
+
+    Every random draw in the pipeline comes from a numpy Generator that is
+    addressed by a key rather than handed down from a parent stream. A key is
+    a tuple of small integers, e.g. (REPLICATE, 3, DAY, 17, SAMPLE) for the
+    interaction sample of replicate 3 on day 17. The generator for a key is
+    a Philox (counter-based) bit generator seeded with
+    SeedSequence(seed, spawn_key=key), the same thing SeedSequence.spawn
+    produces, so streams for different keys are independent and a stream
+    never depends on how many draws were taken from any other stream.
+
+    This is what lets serial, batched and parallel executions of the same
+    replicates produce bit-identical trajectories: a replicate's draws for a
+    given day and phase are the same no matter which process runs it, or
+    which other replicates share its batch.
+'''
+
+# top-level keys
+POPULATION = 0
+REPLICATE = 1
+DATA = 2
+
+# keys within the population
+HOUSEHOLDS = 0
+LOCATIONS = 1
+
+# keys within a replicate
+SETUP = 0
+DAY = 1
+
+# phases within a day
+PROGRESS = 0
+SAMPLE = 1
+TRANSMIT = 2
+
+
+class RandomStreams:
+    '''A family of independent random streams rooted at seed (fresh entropy if None).'''
+
+    def __init__(self, seed=None, key=()):
+        if seed is None:
+            seed = np.random.SeedSequence().entropy
+        self.seed = seed
+        self.key = tuple(key)
+
+    def spawn(self, *key):
+        '''The sub-family of streams whose keys all start with key.'''
+        return RandomStreams(self.seed, self.key + key)
+
+    def generator(self, *key):
+        '''The Generator for key within this family.'''
+        seq = np.random.SeedSequence(self.seed, spawn_key=self.key + key)
+        return np.random.Generator(np.random.Philox(seq))
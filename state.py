@@ -0,0 +1,47 @@
+import numpy as np
+
+'''
+    Typed, array-backed storage for per-person disease state.
+
+    Every person gets a dense integer id (their position in
+    EpidemicSim.people) and each attribute that EpidemicSim keeps as a
+    NetworkX node attribute is held here as one NumPy array instead.
+    Compartments are stored as small integer codes rather than letters.
+'''
+
+S, E, I, Q, R, D = range(6)
+COMPARTMENTS = 'SEIQRD'
+
+
+class PersonState:
+    '''
+    Struct-of-arrays holding the disease state of n people. shape can also be
+    a (replicates, n) tuple to hold several independent copies of the
+    population side by side.
+    '''
+
+    fields = {
+        'state': np.int8,
+        'time_infected': np.int16,
+        'incubation': np.int16,
+        'infection_length': np.int16,
+        'will_die': np.bool_,
+        'test_submitted': np.bool_,
+        'days_since_submitted_test': np.int16,
+        'test_turnaround': np.int16,
+    }
+
+    def __init__(self, shape):
+        self.shape = shape
+        for name, dtype in PersonState.fields.items():
+            setattr(self, name, np.zeros(shape, dtype=dtype))
+
+    def copy(self):
+        other = PersonState(self.shape)
+        for name in PersonState.fields:
+            setattr(other, name, getattr(self, name).copy())
+        return other
+
+    def letters(self):
+        '''Compartment of every person as a NumPy array of letters.'''
+        return np.array(list(COMPARTMENTS))[self.state]
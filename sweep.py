@@ -0,0 +1,240 @@
+import argparse
+import itertools
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+from batch import BatchEpidemicSim
+from epidemic import default_config, graph_population, apply_overrides, needs_interactions
+from interaction import (generate_interactions, index_interactions, people_ids, graph_visits, Interactions,
+                         ShardedInteractions, InteractionChunks)
+from seeding import RandomStreams
+from state import E, I, Q, R, D, S
+import interaction_cache
+from graph_io import read_graph
+
+'''
+    Parameter sweeps over default_config.
+
+    The person arrays (ages and sexes) and the potential-interaction table
+    (person indices and activity codes) are put into shared memory once,
+    the table only if some configuration needs it, and the visits of the
+    graph (see interaction.graph_visits) too if some configuration uses
+    the 'location' transmission. A
+    table sharded on disk (see interaction.ShardedInteractions) stays
+    there, and the workers map its shards as they go through them.
+    Worker processes attach to those blocks without copying them, run every
+    configuration they are handed as a batch of replicates (see
+    batch.BatchEpidemicSim), and return summary metrics, which end up as one
+    row per configuration.
+
+    Keys of a configuration may reach into the distancing protocol with a
+    dot, e.g. 'distancing.W'.
+'''
+
+
+class SharedArrays:
+    '''
+    A set of named NumPy arrays living in multiprocessing.shared_memory
+    blocks. spec() describes them in a form that can be sent to another
+    process, and attach() rebuilds zero-copy views from such a spec.
+    '''
+
+    def __init__(self, arrays):
+        self.blocks = {}
+        self.arrays = {}
+        for name, array in arrays.items():
+            block = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+            view = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+            view[:] = array
+            self.blocks[name] = block
+            self.arrays[name] = view
+
+    def spec(self):
+        return {name: (self.blocks[name].name, view.shape, view.dtype.str)
+                for name, view in self.arrays.items()}
+
+    @staticmethod
+    def attach(spec):
+        blocks = {}
+        arrays = {}
+        for name, (block_name, shape, dtype) in spec.items():
+            block = shared_memory.SharedMemory(name=block_name)
+            blocks[name] = block
+            arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+        return blocks, arrays
+
+    def close(self):
+        self.arrays = {}
+        for block in self.blocks.values():
+            block.close()
+            block.unlink()
+        self.blocks = {}
+
+
+def grid(axes):
+    '''All combinations of the values in axes, a dict of config key -> list of values.'''
+    keys = list(axes.keys())
+    return [dict(zip(keys, values)) for values in itertools.product(*axes.values())]
+
+
+def summarize_point(histories):
+    '''Summary metrics of one configuration, averaged over its replicates.'''
+    peaks = [(h[:, E] + h[:, I] + h[:, Q]).max() for h in histories]
+    ends = [len(h) - 1 for h in histories]
+    final = np.array([h[-1] for h in histories])
+    n = final[0].sum()
+    removed = final[:, R] + final[:, D]
+    return {
+        'peak_infections': np.mean(peaks),
+        'days_to_end': np.mean(ends),
+        'death_rate': np.mean(np.divide(final[:, D], removed, out=np.zeros(len(final)), where=removed > 0)),
+        'pop_death_rate': np.mean(final[:, D] / n),
+        'uninfected': np.mean(final[:, S] / n),
+    }
+
+
+_worker = {}
+
+visit_columns = ('person', 'location', 'start', 'end', 'codes')
+
+
+def _init_worker(spec, config, replicates, shards=None):
+    _worker['blocks'], _worker['arrays'] = SharedArrays.attach(spec)
+    _worker['config'] = config
+    _worker['replicates'] = replicates
+    _worker['shards'] = shards
+
+
+def _run_point(overrides):
+    arrays = _worker['arrays']
+    config = apply_overrides(_worker['config'], overrides)
+    population = (range(len(arrays['ages'])), arrays['ages'], arrays['sexes'])
+    sim = BatchEpidemicSim(None, False, config, _worker['replicates'], population)
+    if 'visit_person' in arrays:
+        sim.visits = tuple(arrays[f'visit_{c}'] for c in visit_columns)
+    sim.start()
+    if _worker.get('shards') is not None:
+        ids = arrays['ids'] if 'ids' in arrays else None
+        chunks = InteractionChunks(ShardedInteractions(_worker['shards']), ids)
+        histories, finished = sim.simulate_chunks(chunks, sim.days)
+    else:
+        histories, finished = sim.simulate_arrays(arrays['u'], arrays['v'], arrays['codes'], sim.days)
+    return summarize_point(histories)
+
+
+def run_sweep(G, points, config={}, replicates=10, workers=1, seed=None, potential_interactions=None):
+    '''
+    Run replicates simulations of G for every configuration in points (a list
+    of override dicts) and return a DataFrame with one row per configuration.
+
+    Every configuration runs the same replicates, i.e. draws from the same
+    random streams (see seeding.py), so differences between rows come from
+    the parameters rather than from sampling noise. The potential
+    interactions of G are generated unless given or not needed by any
+    configuration (see epidemic.needs_interactions).
+    '''
+    config = {**default_config, **config, 'seed': RandomStreams(seed).seed}
+    configs = [apply_overrides(config, point) for point in points]
+    people, ages, sexes = graph_population(G)
+    if potential_interactions is None:
+        if any(needs_interactions(c) for c in configs):
+            potential_interactions = generate_interactions(G, workers)
+        else:
+            potential_interactions = Interactions.empty(people)
+    index = {p: i for i, p in enumerate(people)}
+    visits = {}
+    if any(c['transmission'] == 'location' for c in configs):
+        visits = {f'visit_{c}': column for c, column in zip(visit_columns, graph_visits(G, index))}
+    shards = None
+    if isinstance(potential_interactions, ShardedInteractions):
+        shards = potential_interactions.path
+        ids = people_ids(potential_interactions.people, index)
+        shared = SharedArrays({'ages': ages, 'sexes': sexes, **visits, **({} if ids is None else {'ids': ids})})
+    else:
+        u, v = index_interactions(potential_interactions, index)
+        shared = SharedArrays({
+            'ages': ages,
+            'sexes': sexes,
+            'u': u.astype(np.int32),
+            'v': v.astype(np.int32),
+            'codes': potential_interactions.codes,
+            **visits,
+        })
+    del potential_interactions
+
+    tasks = points
+    start_time = time.time()
+    try:
+        if workers > 1:
+            with ProcessPoolExecutor(
+                    max_workers=workers,
+                    initializer=_init_worker,
+                    initargs=(shared.spec(), config, replicates, shards)) as pool:
+                results = list(tqdm(pool.map(_run_point, tasks), total=len(tasks)))
+        else:
+            _worker.update(arrays=shared.arrays, config=config, replicates=replicates, shards=shards)
+            results = [_run_point(task) for task in tqdm(tasks)]
+            _worker.clear()
+    finally:
+        shared.close()
+    elapsed = time.time() - start_time
+
+    table = pd.DataFrame([{**point, **result} for point, result in zip(points, results)])
+    print(f'Ran {len(points)} configurations x {replicates} replicates in {elapsed:.2f}s')
+    return table
+
+
+def parse_value(value):
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def parse_args(argv=None):
+    argparser = argparse.ArgumentParser(description='Sweep simulation parameters over a grid or a list of configs.')
+    argparser.add_argument('--graph-in', '-i', dest='graph_in', required=True,
+        help='a previously-generated synthetic population')
+    argparser.add_argument('--set', dest='axes', action='append', default=[], metavar='KEY=V1,V2,...',
+        help='add a grid axis, e.g. --set infection_on_interaction=0.4,0.8 or --set distancing.W=0.1,0.3')
+    argparser.add_argument('--configs', dest='configs',
+        help='JSON file holding a list of config overrides to run instead of a grid')
+    argparser.add_argument('--replicates', dest='replicates', type=int, default=10,
+        help='replicates per configuration')
+    argparser.add_argument('--workers', dest='workers', type=int, default=1,
+        help='number of worker processes')
+    argparser.add_argument('--seed', dest='seed', type=int, default=None,
+        help='seed for the sweep')
+    argparser.add_argument('--max-days', dest='maxdays', type=int, default=1000,
+        help='the max number of days for each simulation to last')
+    argparser.add_argument('--output', '-o', dest='output',
+        help='write the summary table to this CSV file')
+    interaction_cache.add_arguments(argparser)
+    return argparser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.configs:
+        with open(args.configs) as f:
+            points = json.load(f)
+    else:
+        axes = {}
+        for axis in args.axes:
+            key, values = axis.split('=', 1)
+            axes[key] = [parse_value(v) for v in values.split(',')]
+        points = grid(axes)
+
+    G = read_graph(args.graph_in)
+    potential_interactions = None
+    if any(needs_interactions(apply_overrides(default_config, point)) for point in points):
+        potential_interactions = interaction_cache.from_args(G, args.graph_in, args)
+    table = run_sweep(G, points, {'days': args.maxdays}, args.replicates, args.workers, args.seed,
+                      potential_interactions)
+    print(table.to_string(index=False))
+    if args.output:
+        table.to_csv(args.output, index=False)
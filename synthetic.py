@@ -0,0 +1,105 @@
+import numpy as np
+from visit_graph import VisitGraph, activity_types
+
+'''
+    Synthetic person-location graphs that need no outside data.
+
+    synthetic_graph builds a graph shaped like epidemic.generate_graph's
+    output, a VisitGraph: P_<i> people (age, income, sex and hhsize, as
+    strings) and L_<j> locations (coords and loctype), joined by one visit
+    per activity with its starttime, endtime (HHMM integers) and acttype. It
+    is meant for benchmarks and tests on machines without the Census API,
+    the NHTS trip files or the Gaston County parcels.
+
+    People live in households of one to six. Each leaves home in the
+    morning and comes back in the evening, so home shows up as two
+    activities, as in SyntheticPerson._gen_activities. In between,
+    children go to school, most working-age adults go to work, and anyone
+    may stop at a shop or some other place. The number of people sharing a
+    workplace, school, shop or other place averages the *_size constants
+    below, which keeps the number of potential interactions per person
+    roughly constant as the graph grows.
+'''
+
+WORK_SIZE = 12
+SCHOOL_SIZE = 300
+SHOP_SIZE = 40
+OTHER_SIZE = 25
+
+# land use codes, as found in the parcel data (see gis.py)
+LOCTYPES = {'H': '1010', 'W': '2010', 'C': '4020', 'S': '2020', 'O': '4040'}
+
+
+def hhmm(minutes):
+    '''Minutes after midnight as an HHMM integer.'''
+    return minutes // 60 * 100 + minutes % 60
+
+
+def synthetic_graph(n, rng=None):
+    '''A person-location VisitGraph of n people, drawing from rng.'''
+    if rng is None:
+        rng = np.random.default_rng()
+
+    sizes = rng.integers(1, 7, size=n)
+    household = np.repeat(np.arange(len(sizes)), sizes)[:n]
+    households = household[-1] + 1
+    ages = rng.integers(0, 90, size=n)
+    sexes = rng.integers(1, 3, size=n)
+    incomes = rng.integers(0, 200000, size=n)
+    hhsizes = np.bincount(household)[household]
+
+    pupil = (ages >= 5) & (ages < 18)
+    worker = (ages >= 18) & (ages < 65) & (rng.random(n) < 0.75)
+    shopper = rng.random(n) < 0.4
+    other = rng.random(n) < 0.3
+
+    counts = {
+        'W': max(1, worker.sum() // WORK_SIZE),
+        'C': max(1, pupil.sum() // SCHOOL_SIZE),
+        'S': max(1, shopper.sum() // SHOP_SIZE),
+        'O': max(1, other.sum() // OTHER_SIZE),
+    }
+    # location ids: homes first, then one block per activity type
+    first = {'H': 0}
+    offset = households
+    for act, count in counts.items():
+        first[act] = offset
+        offset += count
+    places = {act: first[act] + rng.integers(0, count, size=n) for act, count in counts.items()}
+
+    leave = rng.integers(6 * 60, 9 * 60, size=n)
+    busy = np.where(pupil, rng.integers(6 * 60, 8 * 60, size=n), rng.integers(7 * 60, 10 * 60, size=n))
+    shop = rng.integers(15, 90, size=n)
+    errand = rng.integers(30, 180, size=n)
+
+    loctypes = ['H'] * households
+    for act, count in counts.items():
+        loctypes += [act] * count
+    coords = rng.random((offset, 2))
+    location_attrs = {
+        'coords': [str((coords[j, 0], coords[j, 1])) for j in range(offset)],
+        'loctype': [LOCTYPES[t] for t in loctypes],
+    }
+    person_attrs = {name: [str(x) for x in column] for name, column in
+                    (('age', ages), ('income', incomes), ('sex', sexes), ('hhsize', hhsizes))}
+
+    # every person's day in order: home, then the stops they make, then home again
+    codes = {t: i for i, t in enumerate(activity_types)}
+    visits = {c: [] for c in ('person', 'location', 'start', 'end', 'acttype')}
+
+    def visit(i, j, start, end, act):
+        for c, value in zip(visits, (i, j, start, end, codes[act])):
+            visits[c].append(value)
+
+    for i in range(n):
+        home = int(household[i])
+        t = int(leave[i])
+        visit(i, home, 0, hhmm(t), 'H')
+        for act, takes, length in (('C', pupil, busy), ('W', worker, busy), ('S', shopper, shop), ('O', other, errand)):
+            if takes[i]:
+                end = min(t + int(length[i]), 23 * 60)
+                visit(i, int(places[act][i]), hhmm(t), hhmm(end), act)
+                t = end
+        visit(i, home, hhmm(t), 2399, 'H')
+    return VisitGraph([f'P_{i}' for i in range(n)], [f'L_{j}' for j in range(offset)], *visits.values(),
+                      person_attrs, location_attrs)
@@ -0,0 +1,156 @@
+import numpy as np
+import pytest
+from batch import BatchEpidemicSim
+from checkpoint import save_checkpoint, resume
+from ensemble import run_ensemble
+from epidemic import EpidemicSim, ArrayEpidemicSim
+from interaction import generate_interactions, generate_interaction_shards
+from synthetic import synthetic_graph
+
+'''
+    The bit-identity guarantees of the simulators and of interaction
+    generation, on a synthetic graph of 1500 people (see synthetic.py).
+
+    Every replicate draws from its own keyed streams (see seeding.py), so
+    the same seed must give the same trajectory whether a replicate runs
+    alone, in a batch or in a worker process, straight through or resumed
+    from a checkpoint, and over potential interactions in memory or in
+    shards; and interactions generated by several processes must be the
+    ones a single process generates.
+
+    Run with python -m pytest tests.
+'''
+
+SEED = 3
+DAYS = 60
+transmissions = ArrayEpidemicSim.transmissions
+
+
+@pytest.fixture(scope='module')
+def graph():
+    return synthetic_graph(1500, np.random.default_rng(SEED))
+
+
+@pytest.fixture(scope='module')
+def interactions(graph):
+    return generate_interactions(graph)
+
+
+def _run(graph, interactions, transmission, replicate=0):
+    sim = ArrayEpidemicSim(graph, False, {'seed': SEED, 'transmission': transmission, 'replicate': replicate})
+    sim.start()
+    history, finished = sim.simulate(interactions, DAYS, verbose=False)
+    return history
+
+
+def _same(a, b):
+    return len(a) == len(b) and all(np.array_equal(x, y) for x, y in zip(a, b))
+
+
+def test_parallel_generation(graph, interactions):
+    parallel = generate_interactions(graph, 3)
+    assert parallel.people == interactions.people
+    for c in interactions.columns:
+        assert np.array_equal(getattr(parallel, c), getattr(interactions, c))
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_sharded_generation(graph, interactions, tmp_path, workers):
+    sharded = generate_interaction_shards(graph, str(tmp_path / 'table'), 5000, workers)
+    assert len(sharded.shards) > 1
+    for c in interactions.columns:
+        column = np.concatenate([getattr(table, c) for table in sharded.tables()])
+        assert np.array_equal(column, getattr(interactions, c))
+
+
+@pytest.mark.parametrize('transmission', transmissions)
+def test_batch_matches_serial(graph, interactions, transmission):
+    serial = [_run(graph, interactions, transmission, r) for r in range(3)]
+    sim = BatchEpidemicSim(graph, False, {'seed': SEED, 'transmission': transmission}, replicates=3)
+    sim.start()
+    batched, finished = sim.simulate(interactions, DAYS)
+    assert _same(serial, batched)
+
+
+@pytest.mark.parametrize('engine, batch_size', [('graph', 1), ('array', 1), ('array', 2)])
+def test_ensemble_workers(graph, interactions, engine, batch_size):
+    config = {'days': DAYS}
+    serial, _ = run_ensemble(graph, engine, config, 4, 1, SEED, batch_size, interactions)
+    parallel, _ = run_ensemble(graph, engine, config, 4, 2, SEED, batch_size, interactions)
+    assert _same(serial, parallel)
+
+
+@pytest.mark.parametrize('transmission', ['sequential', 'sparse'])
+def test_sharded_simulation(graph, interactions, tmp_path, transmission):
+    sharded = generate_interaction_shards(graph, str(tmp_path / 'table'), 5000)
+    assert np.array_equal(_run(graph, sharded, transmission), _run(graph, interactions, transmission))
+
+
+@pytest.mark.parametrize('transmission', transmissions)
+def test_resume(graph, interactions, tmp_path, transmission):
+    sim = ArrayEpidemicSim(graph, False, {'seed': SEED, 'transmission': transmission})
+    sim.start()
+    sim.simulate(interactions, DAYS // 2, verbose=False)
+    path = str(tmp_path / 'run.npz')
+    save_checkpoint(sim, path)
+    resumed, _ = resume(path, graph)
+    history, finished = resumed.simulate(interactions, DAYS - resumed.day, verbose=False)
+    assert np.array_equal(history, _run(graph, interactions, transmission))
+
+
+def test_resume_graph_engine(graph, interactions, tmp_path):
+    def run():
+        sim = EpidemicSim(graph, False, {'seed': SEED})
+        sim.start()
+        return sim
+
+    sim = run()
+    sim.simulate(interactions, DAYS // 2, verbose=False)
+    path = str(tmp_path / 'run.npz')
+    save_checkpoint(sim, path)
+    resumed, _ = resume(path, graph)
+    history, finished = resumed.simulate(interactions, DAYS - resumed.day, verbose=False)
+    straight, finished = run().simulate(interactions, DAYS, verbose=False)
+    assert np.array_equal(history, straight)
+
+
+@pytest.mark.parametrize('engine', ['graph', 'array'])
+def test_fork(graph, interactions, engine):
+    sim = (EpidemicSim if engine == 'graph' else ArrayEpidemicSim)(graph, False, {'seed': SEED})
+    sim.start()
+    sim.simulate(interactions, DAYS // 2, verbose=False)
+    child = sim.fork()
+    forked, finished = child.simulate(interactions, DAYS - child.day, verbose=False)
+    parent, finished = sim.simulate(interactions, DAYS - sim.day, verbose=False)
+    assert np.array_equal(forked, parent)
+
+
+@pytest.mark.parametrize('transmission', transmissions)
+def test_distancing_starts_the_day_after_a_confirmation(graph, interactions, transmission):
+    # as in EpidemicSim.simulate, which samples before progression can confirm anyone
+    class Recording(ArrayEpidemicSim):
+        def _step(self, chunks):
+            self.confirmed_before = self.confirmed > 0
+            super()._step(chunks)
+
+        def _note(self, distanced):
+            self.seen.append((self.confirmed_before, bool(distanced)))
+
+        def _sample(self, codes, distanced):
+            self._note(distanced)
+            return super()._sample(codes, distanced)
+
+        def _transmit_infectious(self, u, v, codes, distanced):
+            self._note(distanced)
+            super()._transmit_infectious(u, v, codes, distanced)
+
+        def _transmit_location(self, distanced):
+            self._note(distanced)
+            super()._transmit_location(distanced)
+
+    sim = Recording(graph, False, {'seed': SEED, 'transmission': transmission})
+    sim.seen = []
+    sim.start()
+    sim.simulate(interactions, DAYS, verbose=False)
+    assert any(confirmed for confirmed, _ in sim.seen)
+    assert all(confirmed == distanced for confirmed, distanced in sim.seen)
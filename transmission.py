@@ -0,0 +1,183 @@
+import numpy as np
+from scipy import sparse as sp
+from state import S, E, I
+
+'''
+    Vectorized transmission kernels shared by the simulators.
+
+    A kernel takes the compartment code of every person, the day's sampled
+    contacts as two arrays of person indices (u[k], v[k]), the per-contact
+    infection probability p and a uniform(owners) callable returning one
+    uniform draw per entry of owners, and returns the sorted indices of the
+    people that become exposed that day. Draws are requested with the person
+    they are for (or, per contact, its first person) so that batched
+    simulators can take them from that person's replicate's stream.
+
+    sequential  - one draw per sampled contact, in interaction order. This is
+                  the rule EpidemicSim._run_one_iter applies.
+    sparse      - the contacts are put in a sparse person x person matrix and
+                  each susceptible gets infected with 1 - (1 - p)^k, where k
+                  is its number of infectious contacts (one mat-vec), followed
+                  by a single vectorized Bernoulli draw.
+
+    Only infectious people transmit and exposure is absorbing for the day, so
+    both kernels give every susceptible the same chance of being exposed.
+
+    chunked runs a kernel over contacts that come in chunks (one per shard
+    of interaction.ShardedInteractions), drawing exactly what the kernel
+    would over all the chunks put together.
+
+    Incidence indexes the potential interactions by person, so that a
+    simulator can skip the daily sample of all potential interactions and
+    look only at those of the people currently infectious (see
+    ArrayEpidemicSim's 'infectious' transmission).
+
+    LocationSlots does without pairs altogether, for ArrayEpidemicSim's
+    'location' transmission: the visits to every location are binned into
+    time slots, and each visit is exposed to the infectious person-minutes
+    of the slots it spans, so a day costs time linear in the visits
+    however crowded a location gets.
+'''
+
+
+def sequential(states, u, v, p, uniform):
+    states = states.tolist()
+    draws = uniform(u).tolist()
+    exposed = []
+    for a, b, draw in zip(u.tolist(), v.tolist(), draws):
+        a_state = states[a]
+        b_state = states[b]
+
+        # if one is susceptible, then we may want to infect
+        if a_state != S and b_state != S:
+            continue
+
+        if draw < p:
+            if a_state == I and b_state == S:
+                states[b] = E
+                exposed.append(b)
+            elif a_state == S and b_state == I:
+                states[a] = E
+                exposed.append(a)
+    return np.sort(np.array(exposed, dtype=np.int64))
+
+
+def contact_matrix(u, v, n):
+    '''Symmetric n x n matrix counting the sampled contacts between each pair of people.'''
+    rows = np.concatenate([u, v])
+    cols = np.concatenate([v, u])
+    return sp.csr_matrix((np.ones(len(rows), dtype=np.float64), (rows, cols)), shape=(n, n))
+
+
+def sparse(states, u, v, p, uniform):
+    contacts = contact_matrix(u, v, len(states))
+    return _expose_counts(states, contacts @ (states == I).astype(np.float64), p, uniform)
+
+
+def _expose_counts(states, infectious_contacts, p, uniform):
+    candidates = np.flatnonzero((states == S) & (infectious_contacts > 0))
+    prob = 1 - (1 - p) ** infectious_contacts[candidates]
+    return candidates[uniform(candidates) < prob]
+
+
+def chunked(kernel, states, chunks, p, uniform):
+    '''
+    kernels[kernel] over the contacts of every (u, v) chunk in chunks, one
+    chunk after another. sequential sees the exposures of earlier chunks
+    in its working copy of the states, and sparse adds up everyone's
+    infectious contacts chunk by chunk, so both give the same result as
+    over the chunks concatenated.
+    '''
+    if kernel == 'sequential':
+        states = states.copy()
+        exposed = [np.zeros(0, dtype=np.int64)]
+        for u, v in chunks:
+            exposed.append(sequential(states, u, v, p, uniform))
+            states[exposed[-1]] = E
+        return np.sort(np.concatenate(exposed))
+    infectious = (states == I).astype(np.float64)
+    infectious_contacts = np.zeros(len(states))
+    for u, v in chunks:
+        infectious_contacts += np.bincount(v, weights=infectious[u], minlength=len(states))
+        infectious_contacts += np.bincount(u, weights=infectious[v], minlength=len(states))
+    return _expose_counts(states, infectious_contacts, p, uniform)
+
+
+class Incidence:
+    '''
+    Index from every person to the potential interactions (u[k], v[k]) they
+    take part in, in CSR form: the interactions of person i are
+    ids[indptr[i]:indptr[i + 1]].
+    '''
+
+    def __init__(self, u, v, n):
+        ends = np.concatenate([u, v])
+        order = np.argsort(ends, kind='stable')
+        self.ids = order % max(1, len(u))
+        self.indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(ends, minlength=n), out=self.indptr[1:])
+
+    def gather(self, people):
+        '''
+        Ids of the interactions of every person in people, person by person,
+        along with the position in people of the person each one belongs to.
+        '''
+        starts = self.indptr[people]
+        lengths = self.indptr[people + 1] - starts
+        owner = np.repeat(np.arange(len(people)), lengths)
+        first = np.cumsum(lengths) - lengths
+        pos = np.arange(len(owner)) - first[owner] + starts[owner]
+        return self.ids[pos], owner
+
+
+class LocationSlots:
+    '''
+    Visits binned into time slots of slot minutes. Visit j is person[j] at
+    location[j] from start[j] up to end[j] (minutes after midnight). Every
+    (location, slot) pair that some visit spans is a cell, numbered densely,
+    and entry m of the (visit, cell, minutes) arrays says that visit
+    visit[m] spends minutes[m] minutes in cell cell[m].
+    '''
+
+    def __init__(self, person, location, start, end, slot):
+        self.person = np.asarray(person, dtype=np.int64)
+        self.slot = slot
+        start = np.asarray(start, dtype=np.int64)
+        end = np.asarray(end, dtype=np.int64)
+        # visits of no length span no slot
+        first = start // slot
+        spans = np.where(end > start, (end - 1) // slot - first + 1, 0)
+        self.visit = np.repeat(np.arange(len(start)), spans)
+        slots = first[self.visit] + np.arange(len(self.visit)) - np.repeat(np.cumsum(spans) - spans, spans)
+        self.minutes = (np.minimum(end[self.visit], (slots + 1) * slot) -
+                        np.maximum(start[self.visit], slots * slot)).astype(np.float64)
+        n_slots = int(slots.max()) + 1 if len(slots) else 1
+        cells, self.cell = np.unique(np.asarray(location, dtype=np.int64)[self.visit] * n_slots + slots,
+                                     return_inverse=True)
+        self.cell = self.cell.reshape(-1)
+        self.cells = len(cells)
+
+    def exposure(self, infectious):
+        '''
+        For a replicates x visits mask of the visits made by infectious
+        people, the infectious person-minutes each visit shares its slots
+        with, as a replicates x visits array. Within a slot everyone is
+        taken to be there for an even share of its minutes, so a visit gets
+        the slot's infectious person-minutes times the part of the slot it
+        spends there.
+        '''
+        replicates, visits = infectious.shape
+        present = infectious[:, self.visit] * self.minutes
+        occupancy = np.bincount(
+            (np.arange(replicates)[:, np.newaxis] * self.cells + self.cell).reshape(-1),
+            weights=present.reshape(-1), minlength=replicates * self.cells).reshape(replicates, self.cells)
+        shared = occupancy[:, self.cell] * (self.minutes / self.slot)
+        return np.bincount(
+            (np.arange(replicates)[:, np.newaxis] * visits + self.visit).reshape(-1),
+            weights=shared.reshape(-1), minlength=replicates * visits).reshape(replicates, visits)
+
+
+kernels = {
+    'sequential': sequential,
+    'sparse': sparse,
+}
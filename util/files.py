@@ -0,0 +1,26 @@
+import os
+import shutil
+
+'''
+    Directories written in full or not at all.
+
+    A table or graph saved as a directory of files is written to a
+    temporary directory next to its path first (temporary_dir), then moved
+    into place in one rename (replace_dir), so a crash never leaves a torn
+    one. The temporary directory is named after the process, so that runs
+    saving the same directory do not collide.
+'''
+
+
+def temporary_dir(path):
+    '''A fresh temporary directory to write what belongs at path to.'''
+    tmp = f'{path}.{os.getpid()}.tmp'
+    os.makedirs(tmp, exist_ok=True)
+    return tmp
+
+
+def replace_dir(tmp, path):
+    '''Move the temporary directory tmp to path, in place of whatever was there.'''
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    os.replace(tmp, path)
@@ -0,0 +1,22 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+'''
+    Worker pools that share the parent's memory.
+
+    Where the fork start method exists, the workers fork_pool starts
+    inherit the parent's objects copy-on-write, so large read-only inputs
+    (a graph, a simulation to branch from) reach them without being
+    pickled. Elsewhere the initializer arguments get pickled as usual.
+'''
+
+
+def fork_pool(workers, initializer, initargs):
+    '''A ProcessPoolExecutor of workers processes, each set up by initializer(*initargs).'''
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=context,
+        initializer=initializer,
+        initargs=initargs)
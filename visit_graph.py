@@ -0,0 +1,135 @@
+from array import array
+import networkx as nx
+import numpy as np
+
+'''
+    The person-location graph as arrays.
+
+    A VisitGraph holds the same information as the NetworkX MultiGraph that
+    generate_graph used to build: P_<i> people and L_<j> locations, each
+    with their attributes, joined by one edge per visit with its starttime
+    and endtime (HHMM integers) and acttype. Instead of a dict per node and
+    per edge, the visits are columns of a table (person, location, start,
+    end, acttype), and two CSR indexes list the visits of every person and
+    of every location, at a few dozen bytes per visit in all.
+
+    The visits of a location are in the order a MultiGraph built by adding
+    the visits one after another lists them (G[loc], then the keys of each
+    person): grouped by person, people in order of their first visit
+    there. Walks over a VisitGraph and over the MultiGraph it came from
+    therefore meet the visits in the same order.
+
+    Everything from the interactions to the simulators works on a
+    VisitGraph. as_visit_graph turns a MultiGraph (as read from GML, say)
+    into one, and to_networkx goes back, for the graph engine and for
+    writing GML.
+'''
+
+activity_types = 'HWSCO'
+
+
+def _csr(keys, n):
+    '''Positions of the entries of keys grouped by key, in their order, and where each group starts.'''
+    order = np.argsort(keys, kind='stable')
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keys, minlength=n), out=indptr[1:])
+    return indptr, order
+
+
+class VisitGraph:
+    '''
+    Visit k is by person[k] (a position in people) to location[k] (a
+    position in locations), from start[k] to end[k] (HHMM times as in
+    the graph) for activity activity_types[acttype[k]].
+
+    person_attrs and location_attrs map every attribute name to a list of
+    its values, one per person or location. The visits of person i are
+    person_visits[person_ptr[i]:person_ptr[i + 1]], and those of location
+    j, location_visits[location_ptr[j]:location_ptr[j + 1]].
+    '''
+
+    def __init__(self, people, locations, person, location, start, end, acttype,
+                 person_attrs=None, location_attrs=None):
+        self.people = list(people)
+        self.locations = list(locations)
+        self.person = np.asarray(person, dtype=np.int32)
+        self.location = np.asarray(location, dtype=np.int32)
+        self.start = np.asarray(start, dtype=np.int16)
+        self.end = np.asarray(end, dtype=np.int16)
+        self.acttype = np.asarray(acttype, dtype=np.uint8)
+        self.person_attrs = person_attrs or {}
+        self.location_attrs = location_attrs or {}
+        self.person_ptr, self.person_visits = _csr(self.person, len(self.people))
+
+        # a location's visits by person, in order of each person's first visit to it
+        pair = self.location.astype(np.int64) * max(1, len(self.people)) + self.person
+        _, first, inverse = np.unique(pair, return_index=True, return_inverse=True)
+        order = np.lexsort((first[inverse.reshape(-1)], self.location))
+        self.location_ptr = np.zeros(len(self.locations) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.location, minlength=len(self.locations)), out=self.location_ptr[1:])
+        self.location_visits = order
+
+    def __len__(self):
+        '''The number of visits.'''
+        return len(self.person)
+
+    def degrees(self):
+        '''The number of visits to every location.'''
+        return np.diff(self.location_ptr)
+
+    def visits_of(self, j):
+        '''The visits to location j, in order.'''
+        return self.location_visits[self.location_ptr[j]:self.location_ptr[j + 1]]
+
+    def location_index(self):
+        '''Map from location names to their positions in locations.'''
+        return {loc: j for j, loc in enumerate(self.locations)}
+
+    def to_networkx(self):
+        '''The MultiGraph of generate_graph's shape with the same people, locations and visits.'''
+        G = nx.MultiGraph()
+        for names, attrs in ((self.people, self.person_attrs), (self.locations, self.location_attrs)):
+            columns = list(attrs)
+            G.add_nodes_from(zip(names, (dict(zip(columns, row)) for row in zip(*attrs.values())))
+                             if columns else names)
+        people, locations = self.people, self.locations
+        G.add_edges_from(
+            (people[p], locations[j], {'starttime': s, 'endtime': e, 'acttype': activity_types[a]})
+            for p, j, s, e, a in zip(self.person.tolist(), self.location.tolist(), self.start.tolist(),
+                                     self.end.tolist(), self.acttype.tolist()))
+        return G
+
+    @staticmethod
+    def from_networkx(G):
+        '''The VisitGraph of the MultiGraph G, visits taken location by location as G lists them.'''
+        people = [n for n in G.nodes() if str(n).startswith('P_')]
+        locations = [n for n in G.nodes() if not str(n).startswith('P_')]
+        index = {p: i for i, p in enumerate(people)}
+        codes = {t: i for i, t in enumerate(activity_types)}
+        person, location, start, end, acttype = (array(t) for t in 'iihhB')
+        for j, loc in enumerate(locations):
+            for visitor, edges in G[loc].items():
+                for edge in edges.values():
+                    person.append(index[visitor])
+                    location.append(j)
+                    start.append(edge['starttime'])
+                    end.append(edge['endtime'])
+                    acttype.append(codes[edge['acttype']])
+        return VisitGraph(people, locations, person, location, start, end, acttype,
+                          _attributes(G, people), _attributes(G, locations))
+
+
+def _attributes(G, nodes):
+    '''The attributes of nodes in G as lists, one per attribute name.'''
+    attrs = {}
+    for i, n in enumerate(nodes):
+        for name, value in G.nodes[n].items():
+            attrs.setdefault(name, [None] * len(nodes))[i] = value
+    return attrs
+
+
+def as_visit_graph(G):
+    '''G as a VisitGraph, converting it when it is a NetworkX graph.'''
+    if isinstance(G, VisitGraph):
+        return G
+    return VisitGraph.from_networkx(G)